@@ -0,0 +1,413 @@
+# Copyright (C) Huangying Zhan 2019. All rights reserved.
+
+import argparse
+from glob import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+from kitti_odometry import KittiEvalOdom, StageTimer, umeyama_alignment, windowed_alignment_errors
+
+
+# maximum relative drift of each metric with float32 pose storage w.r.t.
+# float64, checked by --validate-float32. Segment errors drift with the
+# extent of the trajectory, since float32 positions are rounded to ~1e-7 of
+# their distance from the origin (~4e-4 at 100 km). The trace-based rotation
+# error of the 1-frame RPE is ill-conditioned and drifts by up to ~1e-2
+# unless the robust rotation error is used
+FLOAT32_TOLERANCES = {
+    "ave_t_err": 1e-3,
+    "ave_r_err": 1e-3,
+    "ate": 1e-5,
+    "rpe_trans": 1e-4,
+    "rpe_rot": 1e-4,
+}
+FLOAT32_TRACE_RPE_ROT_TOLERANCE = 3e-2
+
+
+def synthetic_sequence(num_frames, seed=0):
+    """Generate a KITTI-like driving sequence and a drifting prediction of it.
+    The car moves in the x-z plane at about 1 m/frame (10 m/s at 10 FPS);
+    the prediction has noisy yaw rate and speed.
+    Args:
+        num_frames (int): number of frames
+        seed (int): random seed
+    Returns:
+        gt (Nx3x4 array): ground truth poses
+        pred (Nx3x4 array): predicted poses
+    """
+    rng = np.random.default_rng(seed)
+    yaw_rate = np.cumsum(rng.normal(0, 2e-3, num_frames))
+    yaw_rate = np.clip(yaw_rate, -0.05, 0.05)
+    speed = np.clip(1.0 + np.cumsum(rng.normal(0, 1e-2, num_frames)), 0.2, 2.0)
+
+    def integrate(yaw_rate, speed):
+        yaw = np.cumsum(yaw_rate) - yaw_rate[0]
+        poses = np.zeros((num_frames, 3, 4))
+        poses[:, 0, 0] = np.cos(yaw)
+        poses[:, 0, 2] = np.sin(yaw)
+        poses[:, 1, 1] = 1.
+        poses[:, 2, 0] = -np.sin(yaw)
+        poses[:, 2, 2] = np.cos(yaw)
+        steps = speed[:, None] * poses[:, :, 2]
+        poses[1:, :, 3] = np.cumsum(steps[:-1], axis=0)
+        return poses
+
+    gt = integrate(yaw_rate, speed)
+    pred = integrate(
+                yaw_rate + rng.normal(0, 2e-4, num_frames),
+                speed * (1 + rng.normal(0, 1e-2, num_frames))
+                )
+    return gt, pred
+
+
+def save_poses(file_name, poses):
+    """Save poses in KITTI format
+    Args:
+        file_name (str): txt file path
+        poses (Nx3x4 array): poses
+    """
+    np.savetxt(file_name, poses.reshape(-1, 12), fmt="%.9e")
+
+
+def benchmark_sequence(num_frames, work_dir, alignment="7dof", plot=True, seed=0,
+                            memory=True):
+    """Benchmark every stage of KittiEvalOdom on a synthetic sequence.
+    Stages are timed without tracemalloc, whose overhead would dominate the
+    timings; the peak memory is measured in a separate pass
+    Args:
+        num_frames (int): number of frames
+        work_dir (str): directory for the synthetic files and the outputs
+        alignment (str): alignment type, see KittiEvalOdom.eval
+        plot (bool): benchmark plotting
+        seed (int): random seed
+        memory (bool): measure the peak memory of each stage
+    Returns:
+        stages (dict): {stage: {time, peak_mem_mb, fps}}
+    """
+    gt_dir = os.path.join(work_dir, "gt")
+    result_dir = os.path.join(work_dir, "result")
+    for sub_dir in ["gt", "result/errors", "result/plot_path", "result/plot_error"]:
+        os.makedirs(os.path.join(work_dir, sub_dir), exist_ok=True)
+    gt_poses, pred_poses = synthetic_sequence(num_frames, seed)
+    save_poses(os.path.join(gt_dir, "00.txt"), gt_poses)
+    save_poses(os.path.join(result_dir, "00.txt"), pred_poses)
+    del gt_poses, pred_poses
+
+    timer = StageTimer()
+    run_stages(timer, gt_dir, result_dir, alignment, plot)
+    if memory:
+        mem_timer = StageTimer(memory=True)
+        run_stages(mem_timer, gt_dir, result_dir, alignment, plot)
+        mem_timer.close()
+        for name, record in timer.stages.items():
+            record["peak_mem_mb"] = mem_timer.stages[name]["peak_mem_mb"]
+
+    for record in timer.stages.values():
+        record["fps"] = num_frames / record["time"] if record["time"] > 0 else None
+    return timer.stages
+
+
+def run_stages(timer, gt_dir, result_dir, alignment="7dof", plot=True):
+    """Run every evaluation stage of sequence 00 once with a fresh evaluator
+    Args:
+        timer (StageTimer): timer of the stages
+        gt_dir (str): ground truth poses directory
+        result_dir (str): result directory
+        alignment (str): alignment type, see KittiEvalOdom.eval
+        plot (bool): run the plotting stage
+    """
+    eval_tool = KittiEvalOdom()
+    eval_tool.gt_dir = gt_dir
+    eval_tool.cur_seq = "00"
+    eval_tool.error_dir = result_dir + "/errors"
+    eval_tool.plot_path_dir = result_dir + "/plot_path"
+    eval_tool.plot_error_dir = result_dir + "/plot_error"
+
+    with timer.stage("load"):
+        frame_ids, pose_array = eval_tool.load_pose_array(os.path.join(result_dir, "00.txt"))
+    with timer.stage("prepare_gt"):
+        gt_state = eval_tool.prepare_gt(0)
+
+    with timer.stage("align"):
+        frames = eval_tool.index_frames(frame_ids, gt_state)
+        pred, gt = eval_tool.gather_poses(frames, pose_array, gt_state)
+        gt_state = eval_tool.normalize_gt(gt_state, frames.gt_index[0])
+        eval_tool.normalize_poses(frame_ids, pred, gt)
+        eval_tool.align_poses(pred, gt, alignment)
+
+    with timer.stage("calc_sequence_errors"):
+        seq_err = eval_tool.calc_sequence_errors_arrays(frames, pred, gt_state)
+    with timer.stage("compute_segment_error"):
+        avg_segment_errs = eval_tool.compute_segment_error(seq_err)
+        ave_t_err, ave_r_err = eval_tool.compute_overall_err(seq_err)
+    with timer.stage("compute_ATE"):
+        ate = eval_tool.compute_ATE_arrays(gt, pred)
+    with timer.stage("compute_RPE"):
+        rpe_trans, rpe_rot = eval_tool.compute_RPE_arrays(frame_ids, gt, pred)
+
+    if plot:
+        with timer.stage("plot"):
+            xz_gt, xz_result = eval_tool.downsample_trajectories(gt[:, [0, 2], 3], pred[:, [0, 2], 3])
+            eval_tool.plot_trajectory_xz(xz_gt, xz_result, 0)
+            eval_tool.plot_error(avg_segment_errs, 0)
+
+    with timer.stage("write"):
+        eval_tool.save_sequence_errors(seq_err, result_dir + "/errors/00.txt")
+        with open(os.path.join(result_dir, "result.txt"), 'w') as f:
+            eval_tool.write_result(f, 0, [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot])
+
+
+def validate_precision(name, gt_poses, pred_poses, alignment="7dof", robust_rotation=False):
+    """Compare the metrics of float32 pose storage with float64
+    Args:
+        name (str): name of the sequence in the report
+        gt_poses (Nx3x4 array / dict): ground truth poses, see KittiEvalOdom.eval_poses
+        pred_poses (Mx3x4 array / dict): predicted poses
+        alignment (str): alignment type, see KittiEvalOdom.eval
+        robust_rotation (bool): robust rotation error, see KittiEvalOdom
+    Returns:
+        report (dict): metrics of both modes, their relative drift and
+            the memory of the stored ground truth poses
+    """
+    report = {"name": name, "num_frames": len(pred_poses)}
+    for precision in ["float64", "float32"]:
+        eval_tool = KittiEvalOdom(precision=precision, robust_rotation=robust_rotation)
+        gt_state = eval_tool.gt_state_from_poses(gt_poses)
+        metrics = eval_tool.eval_poses(gt_state, pred_poses, alignment=alignment)
+        report[precision] = {
+            "errs": [float(i) for i in metrics.errs()],
+            "gt_pose_mb": (gt_state.poses.nbytes + gt_state.rel_poses.nbytes) / 1024**2,
+        }
+    errs_64 = np.asarray(report["float64"]["errs"])
+    errs_32 = np.asarray(report["float32"]["errs"])
+    drift = np.abs(errs_32 - errs_64) / np.maximum(np.abs(errs_64), 1e-12)
+    report["relative_drift"] = dict(zip(FLOAT32_TOLERANCES.keys(), drift.tolist()))
+    return report
+
+
+def example_sequences(result_patterns, gt_dir):
+    """Load the predictions of result directories and their ground truth
+    Args:
+        result_patterns (list): result directories or glob patterns
+        gt_dir (str): ground truth poses directory
+    Returns:
+        sequences (list): [(name, gt poses dict, predicted poses dict)]
+    """
+    eval_tool = KittiEvalOdom()
+    sequences = []
+    for result_dir in sorted(set(d for pattern in result_patterns for d in glob(pattern))):
+        for file_name in sorted(os.listdir(result_dir)):
+            gt_file = os.path.join(gt_dir, file_name)
+            if not file_name.endswith(".txt") or not os.path.exists(gt_file):
+                continue
+            sequences.append((
+                os.path.join(os.path.basename(os.path.normpath(result_dir)), file_name[:-4]),
+                eval_tool.load_poses_from_txt(gt_file),
+                eval_tool.load_poses_from_txt(os.path.join(result_dir, file_name))
+                ))
+    return sequences
+
+
+def validate_local_ate(num_frames, windows=(10, 20, 100), alignment="7dof", seed=0):
+    """Compare the windowed ATE from prefix sums (windowed_alignment_errors)
+    with a separate Umeyama alignment of each window on a synthetic sequence.
+    Half-overlapping windows of a fixed size and windows of random sizes
+    between half and all of it (at least 3 frames) are checked
+    Args:
+        num_frames (int): number of frames
+        windows (list): window sizes in frames
+        alignment (str): alignment of each window, 7dof or 6dof
+        seed (int): random seed
+    Returns:
+        report (dict): maximum relative error of the windowed ATE per
+            window size, w.r.t. the direct alignment
+    """
+    gt_poses, pred_poses = synthetic_sequence(num_frames, seed)
+    x = pred_poses[:, :, 3]
+    y = gt_poses[:, :, 3]
+    with_scale = alignment == "7dof"
+    rng = np.random.default_rng(seed)
+    report = {"num_frames": num_frames, "max_relative_error": {}}
+    for window in windows:
+        starts = np.arange(0, num_frames - window + 1, max(window // 2, 1))
+        fixed_stops = starts + window
+        random_stops = starts + rng.integers(max(window // 2, 3), window + 1, len(starts))
+        max_error = 0.
+        for stops in [fixed_stops, random_stops]:
+            errors = windowed_alignment_errors(x, y, starts, stops, with_scale)
+            # direct alignment, batched over the windows of equal size
+            sizes = stops - starts
+            for size in np.unique(sizes):
+                idx = np.flatnonzero(sizes == size)
+                x_win = np.stack([x[start:start + size].T for start in starts[idx]])
+                y_win = np.stack([y[start:start + size].T for start in starts[idx]])
+                r, t, c = umeyama_alignment(x_win, y_win, with_scale)
+                aligned = c[:, None, None] * np.matmul(r, x_win) + t[:, :, None]
+                direct = np.sqrt(np.mean(np.sum((y_win - aligned) ** 2, axis=1), axis=1))
+                rel_error = np.abs(errors[idx] - direct) / np.maximum(direct, 1e-12)
+                max_error = max(max_error, float(rel_error.max()))
+        report["max_relative_error"][str(window)] = max_error
+    report["max_relative_error_all"] = max(report["max_relative_error"].values())
+    return report
+
+
+def git_revision():
+    """Return the current git commit of the repository, None if unknown"""
+    try:
+        return subprocess.check_output(
+                    ["git", "rev-parse", "HEAD"],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    stderr=subprocess.DEVNULL
+                    ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(report, output=None):
+    """Write a report as json
+    Args:
+        report (dict): report
+        output (str): json file. Printed if None
+    """
+    report_json = json.dumps(report, indent=2)
+    if output is None:
+        print(report_json)
+    else:
+        with open(output, 'w') as f:
+            f.write(report_json + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KITTI evaluation benchmark')
+    parser.add_argument('--sizes',
+                        nargs="+",
+                        type=int,
+                        default=[1000, 10000, 100000],
+                        help="numbers of frames of the synthetic sequences")
+    parser.add_argument('--align', type=str,
+                        choices=['scale', 'scale_7dof', '7dof', '6dof'],
+                        default='7dof',
+                        help="alignment type")
+    parser.add_argument('--no-plot', action='store_true',
+                        help="skip the plotting stage")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the second pass measuring the peak memory of each stage")
+    parser.add_argument('--output', type=str,
+                        default=None,
+                        help="json file for the report. Printed if not given")
+    parser.add_argument('--validate-float32', action='store_true',
+                        help="compare the metrics of float32 pose storage with float64 on "
+                            "--examples and the synthetic sequences instead of timing the "
+                            "stages. Fails if the relative drift of a metric exceeds its "
+                            "tolerance")
+    parser.add_argument('--examples',
+                        nargs="+",
+                        default=["result/example_*"],
+                        help="result directories or glob patterns checked against --gt-dir "
+                            "by --validate-float32")
+    parser.add_argument('--gt-dir', type=str,
+                        default="dataset/kitti_odom/gt_poses/",
+                        help="ground truth poses directory of --examples")
+    parser.add_argument('--robust-rotation', action='store_true',
+                        help="validate with the robust rotation error, see eval_odom.py")
+    parser.add_argument('--validate-local-ate', action='store_true',
+                        help="compare the windowed ATE of --local-window with a separate "
+                            "alignment of each window instead of timing the stages. Fails "
+                            "if the relative error exceeds --tolerance")
+    parser.add_argument('--windows',
+                        nargs="+",
+                        type=int,
+                        default=[10, 20, 100],
+                        help="window sizes (frames) checked by --validate-local-ate")
+    parser.add_argument('--tolerance', type=float,
+                        default=None,
+                        help="maximum relative drift of every metric with float32 pose "
+                            "storage (default: per metric, see FLOAT32_TOLERANCES), or "
+                            "relative error of the windowed ATE (default: 1e-4)")
+    args = parser.parse_args()
+
+    if args.validate_float32:
+        sequences = example_sequences(args.examples, args.gt_dir)
+        if len(sequences) == 0:
+            parser.error("no sequences with ground truth in --examples")
+        sequences += [("synthetic_{}".format(num_frames),) + synthetic_sequence(num_frames)
+                        for num_frames in args.sizes]
+        tolerances = dict(FLOAT32_TOLERANCES)
+        if not args.robust_rotation:
+            tolerances["rpe_rot"] = FLOAT32_TRACE_RPE_ROT_TOLERANCE
+        if args.tolerance is not None:
+            tolerances = dict.fromkeys(tolerances, args.tolerance)
+        results = [validate_precision(name, gt_poses, pred_poses, args.align, args.robust_rotation)
+                    for name, gt_poses, pred_poses in sequences]
+        max_drift = {metric: max(result["relative_drift"][metric] for result in results)
+                        for metric in tolerances}
+        failed = [metric for metric in tolerances if max_drift[metric] > tolerances[metric]]
+        report = {
+            "commit": git_revision(),
+            "alignment": args.align,
+            "robust_rotation": args.robust_rotation,
+            "tolerances": tolerances,
+            "max_relative_drift": max_drift,
+            "passed": len(failed) == 0,
+            "results": results,
+        }
+        write_report(report, args.output)
+        if failed:
+            raise SystemExit("float32 metric drift exceeds the tolerance: " + ", ".join(
+                                "{} {:.3g} > {:.3g}".format(metric, max_drift[metric], tolerances[metric])
+                                for metric in failed))
+        return
+
+    if args.validate_local_ate:
+        local_align = args.align if args.align in ["7dof", "6dof"] else "7dof"
+        report = {
+            "commit": git_revision(),
+            "alignment": local_align,
+            "tolerance": 1e-4 if args.tolerance is None else args.tolerance,
+            "results": [validate_local_ate(num_frames, args.windows, local_align)
+                            for num_frames in args.sizes],
+        }
+        max_error = max(result["max_relative_error_all"] for result in report["results"])
+        report["passed"] = max_error <= report["tolerance"]
+        write_report(report, args.output)
+        if not report["passed"]:
+            raise SystemExit("windowed ATE error {:.3g} exceeds the tolerance {:.3g}".format(
+                                max_error, report["tolerance"]))
+        return
+
+    report = {
+        "commit": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "alignment": args.align,
+        "results": [],
+    }
+    for num_frames in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix="kitti_bench_")
+        try:
+            stages = benchmark_sequence(num_frames, work_dir, args.align, not args.no_plot,
+                                            memory=not args.no_memory)
+        finally:
+            shutil.rmtree(work_dir)
+        total_time = sum(stage["time"] for stage in stages.values())
+        report["results"].append({
+            "num_frames": num_frames,
+            "total_time": total_time,
+            "total_fps": num_frames / total_time,
+            "stages": stages,
+        })
+    # ru_maxrss is in kilobytes on Linux
+    report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
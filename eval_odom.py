@@ -1,34 +1,252 @@
 # Copyright (C) Huangying Zhan 2019. All rights reserved.
 
 import argparse
+import os
 
-from kitti_odometry import KittiEvalOdom
-
-parser = argparse.ArgumentParser(description='KITTI evaluation')
-parser.add_argument('--result', type=str, required=True,
-                    help="Result directory")
-parser.add_argument('--align', type=str, 
-                    choices=['scale', 'scale_7dof', '7dof', '6dof'],
-                    default=None,
-                    help="alignment type")
-parser.add_argument('--seqs', 
-                    nargs="+",
-                    type=int, 
-                    help="sequences to be evaluated",
-                    default=None)
-args = parser.parse_args()
-
-eval_tool = KittiEvalOdom()
-gt_dir = "dataset/kitti_odom/gt_poses/"
-result_dir = args.result
-
-continue_flag = input("Evaluate result in {}? [y/n]".format(result_dir))
-if continue_flag == "y":
-    eval_tool.eval(
-        gt_dir,
-        result_dir,
+from kitti_odometry import KittiEvalOdom, ResultCache
+from kitti_stream import KittiStreamEvalOdom
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KITTI evaluation')
+    parser.add_argument('--result', type=str,
+                        help="Result directory")
+    parser.add_argument('--gt-dir', type=str,
+                        default="dataset/kitti_odom/gt_poses/",
+                        help="ground truth poses directory, or a pose store built by --build-store")
+    parser.add_argument('--build-store', type=str,
+                        default=None,
+                        help="pack all pose txt files in --gt-dir into this memory-mapped pose store file")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="do not ask for confirmation before evaluating")
+    parser.add_argument('--batch',
+                        nargs="+",
+                        type=str,
+                        help="result directories or glob patterns evaluated in one run",
+                        default=None)
+    parser.add_argument('--leaderboard', type=str,
+                        default="leaderboard.csv",
+                        help="leaderboard csv written in batch mode")
+    parser.add_argument('--compare',
+                        nargs="+",
+                        type=str,
+                        help="result directories or glob patterns of methods compared in one table and plot",
+                        default=None)
+    parser.add_argument('--names',
+                        nargs="+",
+                        type=str,
+                        help="method names in --compare mode; names of the result directories if not given",
+                        default=None)
+    parser.add_argument('--compare-dir', type=str,
+                        default="comparison",
+                        help="output directory of the comparison table and plots")
+    parser.add_argument('--align', type=str, 
+                        choices=['scale', 'scale_7dof', '7dof', '6dof'],
+                        default=None,
+                        help="alignment type")
+    parser.add_argument('--seqs', 
+                        nargs="+",
+                        type=int, 
+                        help="sequences to be evaluated",
+                        default=None)
+    parser.add_argument('--lengths',
+                        nargs="+",
+                        type=float,
+                        default=None,
+                        help="segment lengths (m); KITTI lengths 100 ... 800 if not given")
+    parser.add_argument('--step-size', type=int,
+                        default=10,
+                        help="number of frames between segment start frames")
+    parser.add_argument('--fps', type=float,
+                        default=10,
+                        help="frame rate of the sequences, used for segment speeds")
+    parser.add_argument('--precision', type=str,
+                        choices=['float64', 'float32'],
+                        default='float64',
+                        help="dtype of the stored poses; float32 halves their memory")
+    parser.add_argument('--fast', action='store_true',
+                        help="faster batched numerics; segment errors differ from the "
+                             "original per-pose evaluation in the last bits")
+    parser.add_argument('--robust-rotation', action='store_true',
+                        help="rotation errors from the skew-symmetric part and the trace "
+                             "of the rotation instead of the trace only (KITTI devkit); "
+                             "accurate for small angles, e.g. 1-frame RPE")
+    parser.add_argument('--jobs', type=int,
+                        default=1,
+                        help="number of sequences evaluated in parallel")
+    parser.add_argument('--no-plot', action='store_true',
+                        help="skip plotting, only compute the metrics")
+    parser.add_argument('--plot-format', type=str,
+                        choices=['pdf', 'png'],
+                        default='pdf',
+                        help="file format of the plots")
+    parser.add_argument('--sync-plot', action='store_true',
+                        help="render plots inline instead of in a background process")
+    parser.add_argument('--profile', type=str,
+                        choices=['cprofile', 'tracemalloc'],
+                        default=None,
+                        help="extra profiling saved with the stage timings")
+    parser.add_argument('--rpe-deltas',
+                        nargs="+",
+                        type=float,
+                        default=None,
+                        help="extra RPE deltas reported in result.txt")
+    parser.add_argument('--rpe-unit', type=str,
+                        choices=['frame', 'm'],
+                        default='frame',
+                        help="unit of --rpe-deltas")
+    parser.add_argument('--error-format', type=str,
+                        choices=['txt', 'npz', 'npy'],
+                        default='txt',
+                        help="file format of the segment errors in RESULT_PATH/errors")
+    parser.add_argument('--bootstrap', type=int,
+                        default=0,
+                        help="number of bootstrap resamples for confidence intervals in result.txt")
+    parser.add_argument('--bootstrap-block', type=int,
+                        default=None,
+                        help="number of frames of a bootstrap block; default: the longest ground-truth segment span of each sequence")
+    parser.add_argument('--confidence', type=float,
+                        default=0.95,
+                        help="confidence level of the bootstrap intervals")
+    parser.add_argument('--local-window', type=float,
+                        default=None,
+                        help="align every window of this many frames (or meters) separately and report the window ATE")
+    parser.add_argument('--local-step', type=float,
+                        default=None,
+                        help="distance between window starts; --local-window if not given")
+    parser.add_argument('--local-unit', type=str,
+                        choices=['frame', 'm'],
+                        default='frame',
+                        help="unit of --local-window and --local-step")
+    parser.add_argument('--local-align', type=str,
+                        choices=['7dof', '6dof'],
+                        default='7dof',
+                        help="alignment of each window")
+    parser.add_argument('--export',
+                        nargs="+",
+                        choices=['json', 'csv'],
+                        default=None,
+                        help="also save all per-sequence and overall metrics as RESULT_PATH/result.json / result.csv")
+    parser.add_argument('--cache-dir', type=str,
+                        default=None,
+                        help="directory of the persistent result cache; unchanged sequences are not evaluated again")
+    parser.add_argument('--cache-size', type=float,
+                        default=512,
+                        help="size limit (MB) of the result cache; least recently used results are evicted")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="remove all results in --cache-dir")
+    parser.add_argument('--follow', action='store_true',
+                        help="evaluate a growing result file of a single sequence while it is written")
+    parser.add_argument('--idle-timeout', type=float,
+                        default=None,
+                        help="stop following after this many seconds without new poses")
+    args = parser.parse_args()
+    cache = None
+    if args.cache_dir is not None:
+        cache = ResultCache(args.cache_dir, args.cache_size)
+    if args.clear_cache:
+        if cache is None:
+            parser.error("--clear-cache requires --cache-dir")
+        print("Removed {} cached results".format(cache.clear()))
+        if args.result is None and args.batch is None and args.compare is None:
+            return
+
+    lengths = args.lengths
+    if lengths is not None:
+        lengths = [int(i) if i.is_integer() else i for i in lengths]
+    eval_tool = KittiEvalOdom(lengths=lengths, step_size=args.step_size, fps=args.fps,
+                                precision=args.precision, fast=args.fast,
+                                robust_rotation=args.robust_rotation)
+    if args.build_store is not None:
+        store = eval_tool.build_pose_store(args.gt_dir, args.build_store)
+        print("Packed {} sequences into {}".format(len(store.index), args.build_store))
+        if args.result is None and args.batch is None and args.compare is None:
+            return
+    if [args.result, args.batch, args.compare].count(None) != 2:
+        parser.error("exactly one of --result, --batch and --compare is required")
+    if args.follow and (args.result is None or args.seqs is None or len(args.seqs) != 1):
+        parser.error("--follow requires --result and a single sequence in --seqs")
+    if args.follow and os.path.isfile(args.gt_dir):
+        parser.error("--follow requires a ground truth directory in --gt-dir")
+    rpe_deltas = args.rpe_deltas
+    if rpe_deltas is not None and args.rpe_unit == 'frame':
+        rpe_deltas = [int(i) for i in rpe_deltas]
+    gt_dir = args.gt_dir
+    # options shared by eval and eval_batch
+    eval_kwargs = dict(
         alignment=args.align,
         seqs=args.seqs,
+        workers=args.jobs,
+        plot=not args.no_plot,
+        profile=args.profile,
+        rpe_deltas=rpe_deltas,
+        rpe_delta_unit=args.rpe_unit,
+        error_format=args.error_format,
+        plot_async=not args.sync_plot,
+        plot_format=args.plot_format,
+        cache=cache,
+        bootstrap=args.bootstrap,
+        bootstrap_block=args.bootstrap_block,
+        confidence=args.confidence,
+        local_window=args.local_window,
+        local_window_step=args.local_step,
+        local_window_unit=args.local_unit,
+        local_alignment=args.local_align,
+        export=args.export,
         )
-else:
-    print("Double check the path!")
+
+    if args.batch is not None:
+        continue_flag = "y" if args.yes else input("Evaluate results in {}? [y/n]".format(" ".join(args.batch)))
+        if continue_flag == "y":
+            eval_tool.eval_batch(
+                gt_dir,
+                args.batch,
+                leaderboard_csv=args.leaderboard,
+                **eval_kwargs
+                )
+        else:
+            print("Double check the path!")
+    elif args.compare is not None:
+        continue_flag = "y" if args.yes else input("Compare results in {}? [y/n]".format(" ".join(args.compare)))
+        if continue_flag == "y":
+            eval_tool.compare(
+                gt_dir,
+                args.compare,
+                args.compare_dir,
+                names=args.names,
+                alignment=args.align,
+                seqs=args.seqs,
+                workers=args.jobs,
+                plot=not args.no_plot,
+                plot_format=args.plot_format,
+                )
+        else:
+            print("Double check the path!")
+    elif args.follow:
+        seq_file = "{:02}.txt".format(args.seqs[0])
+        stream_tool = KittiStreamEvalOdom(
+                        os.path.join(gt_dir, seq_file),
+                        lengths=lengths,
+                        step_size=args.step_size,
+                        fps=args.fps,
+                        )
+        try:
+            stream_tool.eval_stream(
+                args.result + "/" + seq_file,
+                timeout=args.idle_timeout,
+                report_every=100,
+                )
+        except KeyboardInterrupt:
+            stream_tool.print_result()
+    else:
+        result_dir = args.result
+
+        continue_flag = "y" if args.yes else input("Evaluate result in {}? [y/n]".format(result_dir))
+        if continue_flag == "y":
+            eval_tool.eval(gt_dir, result_dir, **eval_kwargs)
+        else:
+            print("Double check the path!")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,86 +1,922 @@
 # Copyright (C) Huangying Zhan 2019. All rights reserved.
 
-import copy
-from matplotlib import pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import cProfile
+import csv
+import io
+import json
+import pstats
+import hashlib
+from itertools import repeat
 import numpy as np
 import os
-from glob import glob
+from glob import glob, escape as glob_escape
+import time
+import tracemalloc
+
+
+# ground truth prepared by the evaluators unpickled in a worker process;
+# kept for all tasks the process runs, see KittiEvalOdom.__setstate__
+_process_gt_cache = {}
+
+# one record per evaluated segment, as saved by save_sequence_errors
+SEGMENT_ERROR_DTYPE = np.dtype([
+    ("first_frame", np.int64),
+    ("r_err", np.float64),
+    ("t_err", np.float64),
+    ("length", np.float64),
+    ("speed", np.float64),
+])
+
+# sequence metrics in the order of the errs lists of compare / export, and
+# the factors converting them to the units of result.txt
+# (%, deg/100m, m, m, deg)
+METRIC_NAMES = ["trans_err", "rot_err", "ate", "rpe_trans", "rpe_rot"]
+METRIC_UNIT_SCALES = np.asarray([100, 180 / np.pi * 100, 1, 1, 180 / np.pi])
 
 
 def scale_lse_solver(X, Y):
     """Least-sqaure-error solver
     Compute optimal scaling factor so that s(X)-Y is minimum
     Args:
-        X (KxN array): current data
-        Y (KxN array): reference data
+        X (KxN array / BxKxN array): current data, or a stack of B data
+        Y (KxN array / BxKxN array): reference data
     Returns:
-        scale (float): scaling factor
+        scale (float / B array): scaling factor
     """
-    scale = np.sum(X * Y)/np.sum(X ** 2)
+    scale = np.sum(X * Y, axis=(-2, -1))/np.sum(X ** 2, axis=(-2, -1))
     return scale
 
 
-def umeyama_alignment(x, y, with_scale=False):
+def umeyama_alignment(x, y, with_scale=False, exact=False):
     """
     Computes the least squares solution parameters of an Sim(m) matrix
     that minimizes the distance between a set of registered points.
     Umeyama, Shinji: Least-squares estimation of transformation parameters
                      between two point patterns. IEEE PAMI, 1991
-    :param x: mxn matrix of points, m = dimension, n = nr. of data points
-    :param y: mxn matrix of points, m = dimension, n = nr. of data points
+    Stacks of b point sets (e.g. many predictions against the same GT)
+    are aligned in a single call.
+    :param x: mxn matrix of points, m = dimension, n = nr. of data points,
+              or bxmxn stack of b matrices
+    :param y: mxn matrix of points, m = dimension, n = nr. of data points,
+              or bxmxn stack of b matrices
     :param with_scale: set to True to align also the scale (default: 1.0 scale)
+    :param exact: add the outer products of the covariance one point after
+                  another, as the original per-point loop, instead of a single
+                  matrix product; the result is reproduced bit-for-bit
     :return: r, t, c - rotation matrix, translation vector and scale factor
+             (bxmxm, bxm and b arrays for stacked inputs)
     """
-    if x.shape != y.shape:
+    if x.shape[-2:] != y.shape[-2:]:
         assert False, "x.shape not equal to y.shape"
+    batched = x.ndim == 3 or y.ndim == 3
 
     # m = dimension, n = nr. of data points
-    m, n = x.shape
+    m, n = x.shape[-2:]
+    x = x.reshape((-1, m, n))
+    y = y.reshape((-1, m, n))
 
     # means, eq. 34 and 35
-    mean_x = x.mean(axis=1)
-    mean_y = y.mean(axis=1)
-
-    # variance, eq. 36
-    # "transpose" for column subtraction
-    sigma_x = 1.0 / n * (np.linalg.norm(x - mean_x[:, np.newaxis])**2)
-
-    # covariance matrix, eq. 38
-    outer_sum = np.zeros((m, m))
-    for i in range(n):
-        outer_sum += np.outer((y[:, i] - mean_y), (x[:, i] - mean_x))
-    cov_xy = np.multiply(1.0 / n, outer_sum)
+    mean_x = x.mean(axis=2)
+    mean_y = y.mean(axis=2)
+    x_centered = x - mean_x[:, :, np.newaxis]
+    y_centered = y - mean_y[:, :, np.newaxis]
+
+    if exact:
+        # variance, eq. 36
+        sigma_x = 1.0 / n * np.asarray([np.linalg.norm(x_i)**2 for x_i in x_centered])
+
+        # covariance matrix, eq. 38; cumsum adds the outer products in order
+        outer_sum = np.zeros((len(x), m, m))
+        chunk = 1 << 16
+        for start in range(0, n, chunk):
+            x_chunk = x_centered[:, :, start:start + chunk].transpose(0, 2, 1)
+            y_chunk = y_centered[:, :, start:start + chunk].transpose(0, 2, 1)
+            outer = y_chunk[:, :, :, np.newaxis] * x_chunk[:, :, np.newaxis, :]
+            outer_sum = np.cumsum(np.concatenate((outer_sum[:, np.newaxis], outer), axis=1), axis=1)[:, -1]
+        cov_xy = np.multiply(1.0 / n, outer_sum)
+    else:
+        # variance, eq. 36
+        sigma_x = 1.0 / n * np.sum(x_centered ** 2, axis=(1, 2))
+
+        # covariance matrix, eq. 38
+        cov_xy = np.matmul(y_centered, x_centered.transpose(0, 2, 1)) / n
+
+    r, t, c = umeyama_from_moments(mean_x, mean_y, sigma_x, cov_xy, with_scale)
+    if batched:
+        return r, t, c
+    return r[0], t[0], (c[0] if with_scale else 1.0)
+
+
+def umeyama_from_moments(mean_x, mean_y, sigma_x, cov_xy, with_scale=False):
+    """Umeyama alignment of b point sets from their first and second moments
+    (see umeyama_alignment), e.g. moments of many windows from prefix sums
+    :param mean_x: bxm means of x
+    :param mean_y: bxm means of y
+    :param sigma_x: b variances of x, eq. 36
+    :param cov_xy: bxmxm covariance matrices, eq. 38
+    :param with_scale: set to True to align also the scale (default: 1.0 scale)
+    :return: r, t, c - bxmxm rotation matrices, bxm translation vectors
+             and b scale factors
+    """
+    m = cov_xy.shape[-1]
 
     # SVD (text betw. eq. 38 and 39)
     u, d, v = np.linalg.svd(cov_xy)
 
     # S matrix, eq. 43
-    s = np.eye(m)
-    if np.linalg.det(u) * np.linalg.det(v) < 0.0:
-        # Ensure a RHS coordinate system (Kabsch algorithm).
-        s[m - 1, m - 1] = -1
+    s = np.tile(np.eye(m), (len(cov_xy), 1, 1))
+    # Ensure a RHS coordinate system (Kabsch algorithm).
+    s[np.linalg.det(u) * np.linalg.det(v) < 0.0, m - 1, m - 1] = -1
 
     # rotation, eq. 40
-    r = u.dot(s).dot(v)
+    r = np.matmul(np.matmul(u, s), v)
 
     # scale & translation, eq. 42 and 41
-    c = 1 / sigma_x * np.trace(np.diag(d).dot(s)) if with_scale else 1.0
-    t = mean_y - np.multiply(c, r.dot(mean_x))
-
+    if with_scale:
+        c = 1 / sigma_x * np.sum(d * np.diagonal(s, axis1=1, axis2=2), axis=1)
+    else:
+        c = np.ones(len(cov_xy))
+    t = mean_y - c[:, np.newaxis] * np.matmul(r, mean_x[:, :, np.newaxis])[:, :, 0]
     return r, t, c
 
 
+def windowed_alignment_errors(x, y, starts, stops, with_scale=False):
+    """Align every window of two point sequences separately (Umeyama) and
+    compute the RMSE of each aligned window.
+    The moments of all windows come from prefix sums, so the cost does not
+    depend on the window size. To keep the cancellation error of the prefix
+    sums at the scale of a window, they restart every chunk of the longest
+    window length and are taken relative to the first point of the chunk.
+    A window then spans at most two chunks; the points of the second one
+    are summed relative to the anchor of the first one.
+    Args:
+        x (Nx3 array): points to be aligned, e.g. predicted positions
+        y (Nx3 array): reference points, e.g. ground truth positions
+        starts (W int array): first point of each window
+        stops (W int array): end (exclusive) of each window
+        with_scale (bool): align scale as well (Sim(3) instead of SE(3))
+    Returns:
+        errors (W array): RMSE of each window after alignment
+    """
+    starts = np.asarray(starts)
+    stops = np.asarray(stops)
+    num_points, m = x.shape
+    chunk = max(int(np.max(stops - starts)), 1)
+    num_chunks = -(-num_points // chunk)
+    chunk_ids = np.arange(num_points) // chunk
+
+    def chunk_prefix_sums(anchor_chunks):
+        # [x, y, |x|^2, |y|^2, y x^T] of every point relative to the first
+        # point of its anchor chunk, summed from the start of its own chunk;
+        # an extra chunk of zeros serves windows ending in the last chunk
+        anchor = anchor_chunks * chunk
+        x_a = x - x[anchor]
+        y_a = y - y[anchor]
+        values = np.zeros((num_chunks * chunk, 2 * m + 2 + m * m))
+        values[:num_points, :m] = x_a
+        values[:num_points, m:2 * m] = y_a
+        values[:num_points, 2 * m] = np.sum(x_a ** 2, axis=1)
+        values[:num_points, 2 * m + 1] = np.sum(y_a ** 2, axis=1)
+        values[:num_points, 2 * m + 2:] = (y_a[:, :, None] * x_a[:, None, :]).reshape(-1, m * m)
+        prefix = np.zeros((num_chunks + 1, chunk + 1, values.shape[1]))
+        prefix[:num_chunks, 1:] = np.cumsum(values.reshape(num_chunks, chunk, -1), axis=1)
+        return prefix
+
+    own = chunk_prefix_sums(chunk_ids)
+    prev = chunk_prefix_sums(np.maximum(chunk_ids - 1, 0))
+    first_chunk = starts // chunk
+    start_pos = starts - first_chunk * chunk
+    stop_pos = stops - first_chunk * chunk
+    sums = own[first_chunk, np.minimum(stop_pos, chunk)] - own[first_chunk, start_pos] \
+            + prev[first_chunk + 1, np.maximum(stop_pos - chunk, 0)]
+
+    n = (stops - starts).astype(np.float64)
+    mean_x = sums[:, :m] / n[:, None]
+    mean_y = sums[:, m:2 * m] / n[:, None]
+    sigma_x = sums[:, 2 * m] / n - np.sum(mean_x ** 2, axis=1)
+    sigma_y = sums[:, 2 * m + 1] / n - np.sum(mean_y ** 2, axis=1)
+    cov_xy = sums[:, 2 * m + 2:].reshape(-1, m, m) / n[:, None, None] \
+                - mean_y[:, :, None] * mean_x[:, None, :]
+
+    r, _, c = umeyama_from_moments(mean_x, mean_y, sigma_x, cov_xy, with_scale)
+    # mean of |y - (c R x + t)|^2 over the window, expanded into the moments
+    mse = sigma_y + c ** 2 * sigma_x - 2 * c * np.sum(r * cov_xy, axis=(1, 2))
+    return np.sqrt(np.maximum(mse, 0))
+
+
+def pow2(x):
+    """Element-wise square with the rounding of ``x**2`` on a float scalar
+    (pow()), so batched results match the per-pose ones bit-for-bit.
+    numpy arrays square with x*x instead, which differs from pow() only
+    when the exact square is within a few thousandths of an ulp of a
+    rounding midpoint; only those values are squared with pow().
+    Args:
+        x (float / array): input
+    Returns:
+        x_sq (float / array): squared input
+    """
+    if np.ndim(x) == 0:
+        return x ** 2
+    x = np.asarray(x, dtype=np.float64)
+    x_sq = x * x
+    with np.errstate(invalid='ignore', over='ignore'):
+        # exact rounding error of x*x (Dekker's product)
+        split = x * 134217729.0
+        hi = split - (split - x)
+        lo = x - hi
+        err = ((hi * hi - x_sq) + 2 * hi * lo) + lo * lo
+        ulp = np.where(err >= 0, np.nextafter(x_sq, np.inf) - x_sq,
+                        x_sq - np.nextafter(x_sq, 0))
+        near_tie = 0.5 * ulp - np.abs(err) < 0.05 * ulp
+    # the split is not exact for huge or tiny values
+    near_tie |= ~(np.abs(x) < 1e100) | ((np.abs(x) < 1e-100) & (x != 0))
+    idx = np.flatnonzero(near_tie)
+    x_sq.flat[idx] = [value ** 2 for value in x.flat[idx].tolist()]
+    return x_sq
+
+
+def error_statistics(errors):
+    """Summarize errors
+    Args:
+        errors (N array): errors
+    Returns:
+        stats (dict): {"mean", "rmse", "median", "max"}; nan if no errors
+    """
+    errors = np.asarray(errors, dtype=np.float64)
+    if len(errors) == 0:
+        return {"mean": np.nan, "rmse": np.nan, "median": np.nan, "max": np.nan}
+    return {
+        "mean": float(np.mean(errors)),
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "median": float(np.median(errors)),
+        "max": float(np.max(errors)),
+    }
+
+
+def block_bootstrap_ci(values, block_ids, num_resamples=1000, confidence=0.95,
+                        seed=0, root=False):
+    """Confidence interval of the mean of errors by block bootstrap.
+    Errors are grouped into blocks (e.g. of neighbouring start frames) which
+    are resampled as a whole, so that correlated errors of overlapping
+    segments are kept together. All resamples are drawn at once from the
+    per-block sums and counts.
+    Args:
+        values (N array): errors
+        block_ids (N int array): block of each error
+        num_resamples (int): number of bootstrap resamples
+        confidence (float): confidence level of the interval
+        seed (int): random seed
+        root (bool): interval of the square root of the mean, e.g. RMSE
+            for squared errors
+    Returns:
+        ci (list): [lower, upper]; nan if the errors fall into less than
+            two blocks, whose resamples carry no information
+    """
+    values = np.asarray(values, dtype=np.float64)
+    _, block_index = np.unique(block_ids, return_inverse=True)
+    block_sums = np.bincount(block_index, weights=values)
+    block_counts = np.bincount(block_index).astype(np.float64)
+    num_blocks = len(block_sums)
+    if num_blocks < 2:
+        return [np.nan, np.nan]
+
+    rng = np.random.default_rng(seed)
+    means = np.empty(num_resamples)
+    # resample in chunks of about 4M block draws to bound memory
+    chunk = max(1, (1 << 22) // num_blocks)
+    for start in range(0, num_resamples, chunk):
+        stop = min(start + chunk, num_resamples)
+        draws = rng.integers(0, num_blocks, size=(stop - start, num_blocks))
+        means[start:stop] = block_sums[draws].sum(axis=1) / block_counts[draws].sum(axis=1)
+    if root:
+        means = np.sqrt(means)
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(means, [alpha, 1 - alpha])
+    return [float(lower), float(upper)]
+
+
+def errors_to_array(err):
+    """Convert sequence errors to a structured array
+    Args:
+        err (list list): [first_frame, rotation error, translation error, length, speed]
+    Returns:
+        err_array (structured array): SEGMENT_ERROR_DTYPE records
+    """
+    err_array = np.empty(len(err), dtype=SEGMENT_ERROR_DTYPE)
+    if len(err) > 0:
+        columns = list(zip(*err))
+        for cnt, name in enumerate(SEGMENT_ERROR_DTYPE.names):
+            err_array[name] = columns[cnt]
+    return err_array
+
+
+def file_digest(file_name):
+    """SHA-1 hex digest of the content of a file
+    Args:
+        file_name (str): file path
+    Returns:
+        digest (str): hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def stack_poses(poses, frame_ids):
+    """Stack poses of the given frames into a single array
+    Args:
+        poses (dict): {idx: 4x4 array}
+        frame_ids (int list): frame indexs to be stacked
+    Returns:
+        pose_array (Nx4x4 array): stacked poses
+    """
+    pose_array = np.empty((len(frame_ids), 4, 4))
+    for cnt, frame_idx in enumerate(frame_ids):
+        pose_array[cnt] = poses[frame_idx]
+    return pose_array
+
+
+def to_homogeneous(pose_array, index=None):
+    """Convert poses to 4x4 homogeneous matrices
+    Args:
+        pose_array (Nx3x4 / Nx4x4 array): poses
+        index (int array): poses to be converted. All poses if None
+    Returns:
+        poses (Mx4x4 array): homogeneous poses, as a new array
+    """
+    num_poses = len(pose_array) if index is None else len(index)
+    poses = np.zeros((num_poses, 4, 4))
+    poses[:, 3, 3] = 1.
+    poses[:, :3] = pose_array[:, :3] if index is None else pose_array[index, :3]
+    return poses
+
+
+def inverse_se3(T):
+    """Closed-form inverse of rigid transformations
+    Args:
+        T (4x4 array / Nx4x4 array): SE(3) matrices
+    Returns:
+        T_inv (4x4 array / Nx4x4 array): inverse matrices
+    """
+    R_t = np.swapaxes(T[..., :3, :3], -1, -2)
+    T_inv = np.zeros(T.shape)
+    T_inv[..., :3, :3] = R_t
+    T_inv[..., :3, 3] = -np.matmul(R_t, T[..., :3, 3:])[..., 0]
+    T_inv[..., 3, 3] = 1.
+    return T_inv
+
+
+def orthonormalize_rotations(poses):
+    """Restore orthonormal rotations of poses which were stored in a lower
+    precision, in place. Rounding to float32 leaves rotation matrices
+    non-orthonormal by ~1e-7, which dominates the trace based rotation error
+    of small rotations (e.g. 1-frame RPE). One Newton-Schulz iteration
+    of the polar decomposition removes it.
+    Args:
+        poses (Nx4x4 array): homogeneous poses
+    """
+    R = poses[:, :3, :3]
+    R_t = np.swapaxes(R, 1, 2)
+    poses[:, :3, :3] = 1.5 * R - 0.5 * np.matmul(R, np.matmul(R_t, R))
+
+
+def poses_from_array(frame_ids, pose_array):
+    """Convert pose array to pose dict
+    Args:
+        frame_ids (N int array): frame indexs
+        pose_array (Nx3x4 / Nx4x4 array): poses
+    Returns:
+        poses (dict): {idx: 4x4 array}
+    """
+    poses = {}
+    for cnt, frame_idx in enumerate(np.asarray(frame_ids).tolist()):
+        P = np.eye(4)
+        P[:3] = pose_array[cnt, :3]
+        poses[frame_idx] = P
+    return poses
+
+
+def downsample_polyline(points, tolerance, max_points=None):
+    """Downsample a polyline for plotting.
+    Vertices which are in the same grid cell as the previous vertex are
+    dropped; every dropped vertex lies within one cell diagonal of a kept one,
+    so the shape is kept up to the tolerance. If more than max_points vertices
+    are left (e.g. a long trajectory looping over the same streets), the
+    tolerance is doubled until they fit.
+    Args:
+        points (Nx2 array): polyline vertices
+        tolerance (float): grid cell size
+        max_points (int): maximum number of vertices. Unbounded if None
+    Returns:
+        points (Mx2 array): kept vertices, including the first and the last one
+    """
+    if len(points) < 3 or not tolerance > 0:
+        return points
+    while True:
+        cells = np.floor(points / tolerance)
+        keep = np.empty(len(points), dtype=bool)
+        keep[0] = True
+        keep[1:] = np.any(cells[1:] != cells[:-1], axis=1)
+        keep[-1] = True
+        if max_points is None or np.count_nonzero(keep) <= max(max_points, 2):
+            return points[keep]
+        tolerance *= 2
+
+
+class SequenceGT():
+    """Ground-truth quantities of a sequence which do not depend on the
+    predictions, computed once and shared by every evaluation of the sequence
+    Poses are stored without the constant bottom row, in the pose dtype
+    of the evaluator (float64 or float32)
+    Attributes:
+        frame_ids (N int array): frame indexs
+        poses (Nx3x4 array): ground truth poses
+        dist (N array): distance of each pose w.r.t frame-0
+        first_frames (M int array): start-frame index of each segment
+        last_frames (M int array): end-frame index of each segment
+        seg_lengths (M int array): length of each segment
+        rel_poses (Mx3x4 array): ground truth relative pose of each segment
+        normalized (dict): {frame position: SequenceGT}, the ground truth
+            normalized to one of its frames, see KittiEvalOdom.normalize_gt
+    """
+    def __init__(self, frame_ids, poses, dist,
+                    first_frames, last_frames, seg_lengths, rel_poses):
+        self.frame_ids = frame_ids
+        self.poses = poses
+        self.dist = dist
+        self.first_frames = first_frames
+        self.last_frames = last_frames
+        self.seg_lengths = seg_lengths
+        self.rel_poses = rel_poses
+        self.normalized = {}
+
+
+class FrameIndex():
+    """Predicted frames of a sequence on the ground-truth timeline.
+    Predictions may skip frames, so metrics select the predicted frames
+    with these index arrays instead of looking up frames one by one
+    Attributes:
+        frame_ids (N int array): predicted frame indexs, sorted
+        gt_index (N int array): position of each predicted frame in the ground truth
+        valid (M bool array): whether each ground-truth frame is predicted
+        pred_index (M int array): position of each ground-truth frame in the
+            predictions, -1 if the frame is not predicted
+    """
+    def __init__(self, frame_ids, gt_index, num_gt_frames):
+        self.frame_ids = frame_ids
+        self.gt_index = gt_index
+        self.valid = np.zeros(num_gt_frames, dtype=bool)
+        self.valid[gt_index] = True
+        self.pred_index = np.full(num_gt_frames, -1, dtype=np.int64)
+        self.pred_index[gt_index] = np.arange(len(gt_index))
+
+
+class SequenceMetrics():
+    """Metrics of an evaluated sequence
+    Attributes:
+        ave_t_err (float): average translation error over all segments
+        ave_r_err (float): average rotation error over all segments (rad/m)
+        ate (float): RMSE of ATE (m)
+        rpe_trans (float): RPE between consecutive frames (m)
+        rpe_rot (float): RPE between consecutive frames (rad)
+        avg_segment_errs (dict): {100:[avg_t_err, avg_r_err],...}
+        seq_err (list list): segment errors, see calc_sequence_errors
+        rpe_stats (dict/None): RPE statistics of extra deltas, see compute_RPE_deltas
+        num_frames (int): number of evaluated frames
+        confidence_intervals (dict/None): bootstrap confidence intervals,
+            see compute_confidence_intervals
+        local_ate (dict/None): ATE statistics of separately aligned windows,
+            see compute_local_ATE
+    """
+    def __init__(self, ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot,
+                    avg_segment_errs, seq_err, rpe_stats=None, num_frames=0,
+                    confidence_intervals=None, local_ate=None):
+        self.ave_t_err = ave_t_err
+        self.ave_r_err = ave_r_err
+        self.ate = ate
+        self.rpe_trans = rpe_trans
+        self.rpe_rot = rpe_rot
+        self.avg_segment_errs = avg_segment_errs
+        self.seq_err = seq_err
+        self.rpe_stats = rpe_stats
+        self.num_frames = num_frames
+        self.confidence_intervals = confidence_intervals
+        self.local_ate = local_ate
+
+    def errs(self):
+        """Main metrics in the order used by eval and result.txt
+        Returns:
+            errs (list): [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]
+        """
+        return [self.ave_t_err, self.ave_r_err, self.ate, self.rpe_trans, self.rpe_rot]
+
+    def to_dict(self):
+        """Metrics as a dict, without the segment errors"""
+        return {
+            "num_frames": self.num_frames,
+            "num_segments": len(self.seq_err),
+            "ave_t_err": self.ave_t_err,
+            "ave_r_err": self.ave_r_err,
+            "ate": self.ate,
+            "rpe_trans": self.rpe_trans,
+            "rpe_rot": self.rpe_rot,
+            "avg_segment_errs": self.avg_segment_errs,
+            "rpe_stats": self.rpe_stats,
+            "confidence_intervals": self.confidence_intervals,
+            "local_ate": self.local_ate,
+        }
+
+
+class StageTimer():
+    """Record wall time of evaluation stages, optionally with the peak
+    memory traced (tracemalloc) while each stage runs
+    Usage example:
+        timer = StageTimer()
+        with timer.stage("load"):
+            ...
+        print(timer.stages)  # {"load": {"time": 0.1}}
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self.counts = {}
+        self.started_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name; repeated stages add up"""
+        if self.memory:
+            # clear_traces also resets the traced peak (reset_peak needs
+            # Python 3.9); frees of blocks allocated earlier are not counted
+            tracemalloc.clear_traces()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(name, {"time": 0.})
+            record["time"] += time.perf_counter() - start
+            if self.memory:
+                mem_peak = tracemalloc.get_traced_memory()[1] / 2**20
+                record["peak_mem_mb"] = max(record.get("peak_mem_mb", 0.), mem_peak)
+
+    def count(self, name, value):
+        """Record a count, e.g. number of frames"""
+        self.counts[name] = value
+
+    def close(self):
+        """Stop tracemalloc if it was started by this timer"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+def profile_summary(profiler, num_functions=20):
+    """Summarize the most expensive functions of a cProfile run
+    Args:
+        profiler (cProfile.Profile): finished profiler
+        num_functions (int): number of functions
+    Returns:
+        summary (list): [{function, ncalls, tottime, cumtime}, ...] sorted by cumtime
+    """
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    summary = []
+    for func, (cc, ncalls, tottime, cumtime, callers) in stats.stats.items():
+        summary.append({
+            "function": "{}:{}({})".format(*func),
+            "ncalls": ncalls,
+            "tottime": tottime,
+            "cumtime": cumtime,
+        })
+    summary.sort(key=lambda item: item["cumtime"], reverse=True)
+    return summary[:num_functions]
+
+
+class ResultCache():
+    """Persistent cache of per-sequence evaluation results.
+    Each entry is a .npz file named after a hash of the prediction file,
+    the ground truth file and the evaluation parameters, holding the metrics,
+    the segment errors and the downsampled trajectories for plotting.
+    Loading an entry marks it as recently used; evict removes the least
+    recently used entries once the cache is larger than max_size_mb.
+    Usage example:
+        cache = ResultCache("~/.cache/kitti_eval")
+        vo_eval.eval(gt_pose_txt_dir, result_pose_txt_dir, cache=cache)
+    """
+    # bump when the content of the entries changes
+    VERSION = 3
+    ERROR_COLUMNS = ["first_frame", "r_err", "t_err", "length", "speed"]
+
+    def __init__(self, cache_dir, max_size_mb=512):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size_mb = max_size_mb
+
+    def key(self, *parts):
+        """Cache key of json-serializable key parts
+        Returns:
+            key (str): hex digest
+        """
+        key_json = json.dumps([self.VERSION] + list(parts), sort_keys=True)
+        return hashlib.sha1(key_json.encode()).hexdigest()
+
+    def entry_file(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key):
+        """Load a cache entry
+        Args:
+            key (str): cache key
+        Returns:
+            entry (dict/None): see save. None if not cached
+        """
+        entry_file = self.entry_file(key)
+        try:
+            with np.load(entry_file) as data:
+                entry = json.loads(str(data["meta"]))
+                columns = [data[name].tolist() for name in self.ERROR_COLUMNS]
+                entry["seq_err"] = [list(err) for err in zip(*columns)]
+                entry["xz_gt"] = data["xz_gt"]
+                entry["xz_result"] = data["xz_result"]
+            # mark as recently used
+            os.utime(entry_file)
+        except (OSError, KeyError, ValueError):
+            return None
+        entry["rpe_stats"] = dict(entry["rpe_stats"]) if entry["rpe_stats"] is not None else None
+        return entry
+
+    def save(self, key, entry):
+        """Save a cache entry
+        Args:
+            key (str): cache key
+            entry (dict):
+                - errs (list): [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]
+                - rpe_stats (dict/None): see compute_RPE_deltas
+                - confidence_intervals (dict/None): see compute_confidence_intervals
+                - local_ate (dict/None): see compute_local_ATE
+                - counts (dict): frame and segment counts
+                - seq_err (list list): segment errors, see calc_sequence_errors
+                - xz_gt, xz_result (Nx2 array/None): trajectories for plotting
+        """
+        meta = {
+            "errs": [float(i) for i in entry["errs"]],
+            "rpe_stats": list(entry["rpe_stats"].items()) if entry["rpe_stats"] is not None else None,
+            "confidence_intervals": entry["confidence_intervals"],
+            "local_ate": entry["local_ate"],
+            "counts": entry["counts"],
+        }
+        arrays = {name: np.asarray([err[cnt] for err in entry["seq_err"]])
+                    for cnt, name in enumerate(self.ERROR_COLUMNS)}
+        for name in ["xz_gt", "xz_result"]:
+            arrays[name] = entry[name] if entry[name] is not None else np.empty((0, 2))
+        entry_file = self.entry_file(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = entry_file + ".{}.tmp".format(os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, meta=np.asarray(json.dumps(meta)), **arrays)
+            os.replace(tmp_file, entry_file)
+        except OSError:
+            # read-only location; run without cache
+            pass
+
+    def entries(self):
+        """Cache entries, least recently used first
+        Returns:
+            entries (list): [(entry_file, size), ...]
+        """
+        entries = []
+        for entry_file in glob(os.path.join(glob_escape(self.cache_dir), "*.npz")):
+            try:
+                stat = os.stat(entry_file)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, entry_file, stat.st_size))
+        entries.sort()
+        return [(entry_file, size) for _, entry_file, size in entries]
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size_mb
+        Returns:
+            num_removed (int): number of removed entries
+        """
+        entries = self.entries()
+        total_size = sum(size for _, size in entries)
+        num_removed = 0
+        for entry_file, size in entries:
+            if total_size <= self.max_size_mb * 1024 * 1024:
+                break
+            try:
+                os.remove(entry_file)
+            except OSError:
+                continue
+            total_size -= size
+            num_removed += 1
+        return num_removed
+
+    def clear(self):
+        """Remove all entries
+        Returns:
+            num_removed (int): number of removed entries
+        """
+        num_removed = 0
+        for entry_file, _ in self.entries():
+            try:
+                os.remove(entry_file)
+                num_removed += 1
+            except OSError:
+                pass
+        return num_removed
+
+
+class PoseStore():
+    """Packed binary store of the poses of many sequences, built once from
+    a directory of pose txt files (see KittiEvalOdom.build_pose_store).
+    The file is memory-mapped and sequences are read as zero-copy slices,
+    so opening a store only reads its index, and evaluating a sequence
+    only touches the pages of that sequence.
+    File layout (little-endian):
+        - header: magic, offset and size (bytes) of the index
+        - one block per sequence: N*12 float64 pose values followed by
+          the N int64 frame indexs
+        - index: json {name: {offset, num_poses, digest}}
+    Usage example:
+        store = vo_eval.build_pose_store(gt_pose_txt_dir, "gt_poses.kps")
+        frame_ids, poses = store.load("09")
+        vo_eval.eval("gt_poses.kps", result_pose_txt_dir)
+    """
+    MAGIC = b"KITTIPS1"
+    HEADER_DTYPE = np.dtype([("magic", "S8"), ("index_offset", "<u8"), ("index_size", "<u8")])
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.open()
+
+    def open(self):
+        """Read the index and memory-map the file"""
+        header = np.fromfile(self.file_name, dtype=self.HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != self.MAGIC:
+            raise ValueError("{} is not a pose store".format(self.file_name))
+        with open(self.file_name, 'rb') as f:
+            f.seek(int(header["index_offset"][0]))
+            self.index = json.loads(f.read(int(header["index_size"][0])).decode())
+        self.data = np.memmap(self.file_name, dtype=np.uint8, mode='r')
+
+    def __getstate__(self):
+        # worker processes map the file again instead of receiving its content
+        return {"file_name": self.file_name}
+
+    def __setstate__(self, state):
+        self.file_name = state["file_name"]
+        self.open()
+
+    def digest(self, name):
+        """sha1 digest of the txt file a sequence was built from"""
+        return self.index[name]["digest"]
+
+    def load(self, name):
+        """Poses of a sequence, as read-only views of the mapped file
+        Args:
+            name (str): sequence name, e.g. 09
+        Returns:
+            frame_ids (N int array): frame indexs
+            poses (Nx3x4 array): poses
+        """
+        if name not in self.index:
+            raise KeyError("Sequence {} is not in {}".format(name, self.file_name))
+        entry = self.index[name]
+        num_poses = entry["num_poses"]
+        poses = np.ndarray((num_poses, 3, 4), dtype="<f8",
+                            buffer=self.data, offset=entry["offset"])
+        frame_ids = np.ndarray((num_poses,), dtype="<i8",
+                            buffer=self.data, offset=entry["offset"] + num_poses * 96)
+        return frame_ids, poses
+
+    @staticmethod
+    def build(file_name, sequences):
+        """Write a pose store. Sequences are written one at a time
+        Args:
+            file_name (str): store file path
+            sequences (iterable): (name, digest, frame_ids, poses) of each sequence
+                - name (str): sequence name
+                - digest (str): digest of the sequence source, see file_digest
+                - frame_ids (N int array): frame indexs
+                - poses (Nx3x4 array): poses
+        Returns:
+            store (PoseStore): the new store
+        """
+        index = {}
+        header = np.zeros(1, dtype=PoseStore.HEADER_DTYPE)
+        tmp_file = file_name + ".{}.tmp".format(os.getpid())
+        with open(tmp_file, 'wb') as f:
+            f.write(header.tobytes())
+            for name, digest, frame_ids, poses in sequences:
+                index[name] = {"offset": f.tell(), "num_poses": len(frame_ids), "digest": digest}
+                f.write(np.ascontiguousarray(poses[:, :3], dtype="<f8").tobytes())
+                f.write(np.ascontiguousarray(frame_ids, dtype="<i8").tobytes())
+            index_json = json.dumps(index, sort_keys=True).encode()
+            header[0] = (PoseStore.MAGIC, f.tell(), len(index_json))
+            f.write(index_json)
+            f.seek(0)
+            f.write(header.tobytes())
+        os.replace(tmp_file, file_name)
+        return PoseStore(file_name)
+
+
 class KittiEvalOdom():
     """Evaluate odometry result
     Usage example:
         vo_eval = KittiEvalOdom()
         vo_eval.eval(gt_pose_txt_dir, result_pose_txt_dir)
     """
-    def __init__(self):
-        self.lengths = [100, 200, 300, 400, 500, 600, 700, 800]
+    def __init__(self, lengths=None, step_size=10, fps=10, precision="float64",
+                    fast=False, robust_rotation=False):
+        """
+        Args:
+            lengths (list): segment lengths (m). KITTI lengths
+                [100, 200, ..., 800] if None
+            step_size (int): number of frames between segment start frames
+            fps (float): frame rate, used for the speed of the segments
+            precision (str): dtype of the stored poses (ground truth and
+                predictions), float64 or float32. float32 halves the memory
+                of the stored poses; all computations and error reductions
+                are done in float64
+            fast (bool): faster batched numerics: segment errors from the
+                ground truth segments prepared once per sequence (prepare_gt),
+                closed-form pose inverses, x*x squares and a matrix-product
+                covariance in the alignment. Metrics differ from the original
+                per-pose evaluation in the last bits. If False, the ground
+                truth is normalized to the first predicted frame and segmented
+                again, and errors/XX.txt are bit-identical to the original
+            robust_rotation (bool): compute rotation errors from both the
+                skew-symmetric part and the trace of the rotation, see
+                rotation_error. If False, from the trace only as the KITTI
+                devkit, which is ill-conditioned for small angles
+        """
+        if lengths is None:
+            lengths = [100, 200, 300, 400, 500, 600, 700, 800]
+        self.lengths = list(lengths)
         self.num_lengths = len(self.lengths)
-
-    def load_poses_from_txt(self, file_name):
+        self.step_size = step_size
+        self.fps = fps
+        self.pose_dtype = np.dtype(precision)
+        self.fast = fast
+        self.robust_rotation = robust_rotation
+        self.gt_store = None
+        self.gt_cache = {}
+        # process pool shared by the eval calls of a batch, see eval_batch
+        self.worker_pool = None
+        # name of the evaluated sequence, used in error messages
+        self.cur_seq = None
+        self.timer = StageTimer()
+        # errors/XX file format: txt, npz or npy
+        self.error_format = "txt"
+        # extra RPE deltas reported besides the 1-frame RPE
+        self.rpe_deltas = None
+        self.rpe_delta_unit = "frame"
+        # render plots in a background process (see eval)
+        self.plot_async = False
+        # plot file format (pdf or png) and the trajectory downsampling
+        # tolerance in pixels
+        self.plot_format = "pdf"
+        self.plot_dpi = 100
+        self.plot_tolerance = 0.5
+        self.plot_max_points = 50000
+        # persistent per-sequence result cache (ResultCache), see eval
+        self.result_cache = None
+        # bootstrap confidence intervals; disabled if bootstrap_resamples is 0
+        self.bootstrap_resamples = 0
+        self.bootstrap_block = None
+        self.confidence = 0.95
+        # windowed (local) alignment ATE; disabled if local_window is None
+        self.local_window = None
+        self.local_window_step = None
+        self.local_window_unit = "frame"
+        self.local_alignment = "7dof"
+
+    def __getstate__(self):
+        # neither the ground truth cache nor the process pool is sent to
+        # worker processes; each worker prepares the ground truth of its
+        # own sequences
+        state = self.__dict__.copy()
+        state['gt_cache'] = None
+        state['worker_pool'] = None
+        return state
+
+    def __setstate__(self, state):
+        # every task unpickles a new evaluator; they share the ground truth
+        # of the process, so a worker prepares each sequence only once
+        # for all runs of a batch
+        self.__dict__.update(state)
+        self.gt_cache = _process_gt_cache
+
+    def load_poses_from_txt(self, file_name, cache=False):
         """Load poses from txt (KITTI format)
         Each line in the file should follow one of the following structures
             (1) idx pose(3x4 matrix in terms of 12 numbers)
@@ -88,154 +924,421 @@ class KittiEvalOdom():
 
         Args:
             file_name (str): txt file path
+            cache (bool): use binary cache, see load_pose_array
         Returns:
             poses (dict): {idx: 4x4 array}
         """
-        f = open(file_name, 'r')
-        s = f.readlines()
-        f.close()
-        poses = {}
-        for cnt, line in enumerate(s):
-            P = np.eye(4)
-            line_split = [float(i) for i in line.split(" ") if i!=""]
-            withIdx = len(line_split) == 13
-            for row in range(3):
-                for col in range(4):
-                    P[row, col] = line_split[row*4 + col + withIdx]
-            if withIdx:
-                frame_idx = line_split[0]
-            else:
-                frame_idx = cnt
-            poses[frame_idx] = P
-        return poses
+        frame_ids, pose_array = self.load_pose_array(file_name, cache)
+        return poses_from_array(frame_ids, pose_array)
+
+    def load_pose_array(self, file_name, cache=False):
+        """Load poses from txt (KITTI format) as arrays
+        Both structures in load_poses_from_txt are supported.
+        If cache is True, the parsed poses are kept in a hidden .npy file
+        next to the txt file, named after the hash of the txt content.
+        Later loads memory-map the cache instead of parsing the txt.
+        The cache is a flat float64 array holding the N*12 pose values
+        followed by the N frame indexs.
+
+        Args:
+            file_name (str): txt file path
+            cache (bool): use binary cache
+        Returns:
+            frame_ids (N int array): frame indexs
+            poses (Nx3x4 array): poses; read-only if loaded from cache
+        """
+        if not cache:
+            return self.parse_pose_txt(file_name)
+
+        digest = file_digest(file_name)[:16]
+        file_dir, base_name = os.path.split(file_name)
+        cache_prefix = os.path.join(file_dir, "." + base_name + ".")
+        cache_file = cache_prefix + digest + ".npy"
+
+        if os.path.exists(cache_file):
+            data = np.load(cache_file, mmap_mode='r')
+            num_poses = data.shape[0] // 13
+            pose_array = data[:num_poses*12].reshape(num_poses, 3, 4)
+            frame_ids = np.asarray(data[num_poses*12:], dtype=np.int64)
+            return frame_ids, pose_array
+
+        frame_ids, pose_array = self.parse_pose_txt(file_name)
+        data = np.concatenate((pose_array.ravel(), frame_ids.astype(np.float64)))
+        try:
+            # remove caches of older content
+            for old_cache in glob(glob_escape(cache_prefix) + "*.npy"):
+                os.remove(old_cache)
+            tmp_file = cache_file + ".{}.tmp".format(os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            # read-only location; run without cache
+            pass
+        return frame_ids, pose_array
+
+    def parse_pose_txt(self, file_name):
+        """Parse poses from txt (KITTI format) in one bulk call
+        Args:
+            file_name (str): txt file path
+        Returns:
+            frame_ids (N int array): frame indexs
+            poses (Nx3x4 array): poses
+        """
+        data = np.loadtxt(file_name, dtype=np.float64, ndmin=2)
+        withIdx = data.shape[1] == 13
+        if withIdx:
+            frame_ids = data[:, 0].astype(np.int64)
+        else:
+            frame_ids = np.arange(data.shape[0], dtype=np.int64)
+        pose_array = np.ascontiguousarray(data[:, withIdx:]).reshape(-1, 3, 4)
+        return frame_ids, pose_array
 
     def trajectory_distances(self, poses):
         """Compute distance for each pose w.r.t frame-0
         Args:
-            poses (dict): {idx: 4x4 array}
+            poses (dict / Nx4x4 array): {idx: 4x4 array}, or poses in frame order
         Returns:
-            dist (float list): distance of each pose w.r.t frame-0
-        """
-        dist = [0]
-        sort_frame_idx = sorted(poses.keys())
-        for i in range(len(sort_frame_idx)-1):
-            cur_frame_idx = sort_frame_idx[i]
-            next_frame_idx = sort_frame_idx[i+1]
-            P1 = poses[cur_frame_idx]
-            P2 = poses[next_frame_idx]
-            dx = P1[0, 3] - P2[0, 3]
-            dy = P1[1, 3] - P2[1, 3]
-            dz = P1[2, 3] - P2[2, 3]
-            dist.append(dist[i]+np.sqrt(dx**2+dy**2+dz**2))
+            dist (N array): distance of each pose w.r.t frame-0
+        """
+        if isinstance(poses, dict):
+            poses = stack_poses(poses, sorted(poses.keys()))
+        xyz = poses[:, :3, 3]
+        delta = xyz[:-1] - xyz[1:]
+        if self.fast:
+            step_dist = np.sqrt(np.sum(delta * delta, axis=1))
+        else:
+            step_dist = np.sqrt(pow2(delta[:, 0])+pow2(delta[:, 1])+pow2(delta[:, 2]))
+        dist = np.concatenate(([0.], np.cumsum(step_dist)))
         return dist
 
     def rotation_error(self, pose_error):
-        """Compute rotation error
+        """Compute rotation error.
+        The arccos of the trace loses about half of the significant digits
+        of small angles, e.g. of 1-frame RPE, to the rounding of the poses.
+        With self.robust_rotation the angle is taken from the sine (the
+        skew-symmetric part) and the cosine (the trace) instead
         Args:
-            pose_error (4x4 array): relative pose error
+            pose_error (4x4 array / Nx4x4 array): relative pose error(s)
         Returns:
-            rot_error (float): rotation error
+            rot_error (float / N array): rotation error
         """
-        a = pose_error[0, 0]
-        b = pose_error[1, 1]
-        c = pose_error[2, 2]
+        a = pose_error[..., 0, 0]
+        b = pose_error[..., 1, 1]
+        c = pose_error[..., 2, 2]
+        if self.robust_rotation:
+            skew = np.stack((
+                        pose_error[..., 2, 1] - pose_error[..., 1, 2],
+                        pose_error[..., 0, 2] - pose_error[..., 2, 0],
+                        pose_error[..., 1, 0] - pose_error[..., 0, 1],
+                        ), axis=-1)
+            return np.arctan2(np.linalg.norm(skew, axis=-1), a+b+c-1.0)
         d = 0.5*(a+b+c-1.0)
-        rot_error = np.arccos(max(min(d, 1.0), -1.0))
+        rot_error = np.arccos(np.clip(d, -1.0, 1.0))
         return rot_error
 
+    def orthonormalize(self, poses, dtype):
+        """Orthonormalize the rotations of poses stored in a lower precision
+        than float64, in place (see orthonormalize_rotations). Not needed by
+        the robust rotation error, which does not depend on the
+        non-orthonormality, so that both precisions compute the same errors
+        Args:
+            poses (Nx4x4 array): homogeneous poses
+            dtype (np.dtype): dtype the poses were stored in
+        """
+        if dtype != np.float64 and not self.robust_rotation:
+            orthonormalize_rotations(poses)
+
     def translation_error(self, pose_error):
         """Compute translation error
         Args:
-            pose_error (4x4 array): relative pose error
+            pose_error (4x4 array / Nx4x4 array): relative pose error(s)
         Returns:
-            trans_error (float): translation error
+            trans_error (float / N array): translation error
         """
-        dx = pose_error[0, 3]
-        dy = pose_error[1, 3]
-        dz = pose_error[2, 3]
-        trans_error = np.sqrt(dx**2+dy**2+dz**2)
+        dx = pose_error[..., 0, 3]
+        dy = pose_error[..., 1, 3]
+        dz = pose_error[..., 2, 3]
+        if self.fast:
+            trans_error = np.sqrt(dx*dx+dy*dy+dz*dz)
+        else:
+            trans_error = np.sqrt(pow2(dx)+pow2(dy)+pow2(dz))
         return trans_error
 
     def last_frame_from_segment_length(self, dist, first_frame, length):
         """Find frame (index) that away from the first_frame with
         the required distance
         Args:
-            dist (float list): distance of each pose w.r.t frame-0
+            dist (N array): distance of each pose w.r.t frame-0
             first_frame (int): start-frame index
             length (float): required distance
         Returns:
             i (int) / -1: end-frame index. if not found return -1
         """
-        for i in range(first_frame, len(dist), 1):
-            if dist[i] > (dist[first_frame] + length):
-                return i
-        return -1
+        last_frame = self.segment_end_frames(dist, [first_frame], [length])
+        return int(last_frame[0, 0])
+
+    def segment_end_frames(self, dist, first_frames, lengths):
+        """Find end frames of all segments starting at first_frames
+        with the required lengths. The end frame is the first frame whose
+        distance is strictly greater than dist[first_frame] + length.
+        Args:
+            dist (N array): distance of each pose w.r.t frame-0
+            first_frames (int array): start-frame indexs
+            lengths (float array): required distances
+        Returns:
+            last_frames (FxL int array): end-frame index of each
+                (first_frame, length) pair. -1 if not found
+        """
+        dist = np.asarray(dist)
+        first_frames = np.asarray(first_frames, dtype=np.int64)
+        target = dist[first_frames][:, None] + np.asarray(lengths)[None, :]
+        last_frames = np.searchsorted(dist, target.ravel(), side='right')
+        last_frames = last_frames.reshape(target.shape)
+        last_frames = np.maximum(last_frames, first_frames[:, None])
+        last_frames[last_frames >= len(dist)] = -1
+        return last_frames
+
+    def segment_gt(self, poses_gt):
+        """Find all evaluation segments of the ground truth and
+        compute their relative poses
+        Args:
+            poses_gt (dict): {idx: 4x4 array}, ground truth poses
+        Returns:
+            gt_state (SequenceGT): ground truth quantities
+        """
+        frame_ids = np.asarray(sorted(poses_gt.keys()))
+        return self.segment_gt_arrays(frame_ids, stack_poses(poses_gt, frame_ids))
 
-    def calc_sequence_errors(self, poses_gt, poses_result):
+    def segment_gt_arrays(self, frame_ids, pose_array):
+        """Same as segment_gt for ground truth poses held in arrays
+        (e.g. slices of a PoseStore), without building a pose dict
+        Args:
+            frame_ids (N int array): frame indexs
+            pose_array (Nx3x4 / Nx4x4 array): ground truth poses
+        Returns:
+            gt_state (SequenceGT): ground truth quantities
+        """
+        if np.any(frame_ids[1:] < frame_ids[:-1]):
+            order = np.argsort(frame_ids, kind="stable")
+            frame_ids, pose_array = frame_ids[order], pose_array[order]
+        dist = self.trajectory_distances(pose_array)
+
+        # Find all (first_frame, last_frame) pairs up front
+        first_frames = np.arange(0, len(pose_array), self.step_size)
+        last_frames = self.segment_end_frames(dist, first_frames, self.lengths)
+        first_frames = np.repeat(first_frames[:, None], self.num_lengths, axis=1)
+        seg_lengths = np.tile(self.lengths, (len(first_frames), 1))
+
+        # Skip segments when sequence not long enough
+        valid = last_frames != -1
+        first_frames = first_frames[valid]
+        last_frames = last_frames[valid]
+        seg_lengths = seg_lengths[valid]
+
+        rel_poses = self.relative_poses(pose_array, first_frames, last_frames)
+        rel_poses = np.ascontiguousarray(rel_poses[:, :3], dtype=self.pose_dtype)
+        pose_array = np.ascontiguousarray(pose_array[:, :3], dtype=self.pose_dtype)
+        return SequenceGT(np.asarray(frame_ids), pose_array, dist,
+                            first_frames, last_frames, seg_lengths, rel_poses)
+
+    def open_gt(self, gt_dir):
+        """Set the ground truth location
+        Args:
+            gt_dir (str): ground truth poses txt files directory, or a
+                PoseStore file built by build_pose_store
+        """
+        self.gt_dir = gt_dir
+        if not os.path.isfile(gt_dir):
+            self.gt_store = None
+        elif self.gt_store is None or self.gt_store.file_name != gt_dir:
+            self.gt_store = PoseStore(gt_dir)
+
+    def prepare_gt(self, seq):
+        """Load ground truth of a sequence from self.gt_dir and precompute
+        its segments. Results are cached so that evaluating many results
+        against the same ground truth does the work only once.
+        Args:
+            seq (int): sequence index
+        Returns:
+            gt_state (SequenceGT): ground truth quantities
+        """
+        seq_name = '{:02}'.format(seq)
+        gt_file = os.path.join(self.gt_dir, seq_name + '.txt')
+        if self.gt_store is not None:
+            gt_file = self.gt_dir + ":" + seq_name
+        key = (os.path.abspath(gt_file), tuple(self.lengths), self.step_size,
+                    self.pose_dtype.str)
+        if key not in self.gt_cache:
+            if self.gt_store is not None:
+                frame_ids, pose_array = self.gt_store.load(seq_name)
+            else:
+                frame_ids, pose_array = self.load_pose_array(gt_file, cache=True)
+            self.gt_cache[key] = self.segment_gt_arrays(frame_ids, pose_array)
+        return self.gt_cache[key]
+
+    def build_pose_store(self, txt_dir, store_file):
+        """Pack all pose txt files (KITTI format) of a directory into a
+        PoseStore. Files are parsed one at a time, so memory does not grow
+        with the number of sequences
+        Args:
+            txt_dir (str): pose txt files directory; sequences are named after
+                the files, e.g. 09 for 09.txt
+            store_file (str): PoseStore file path
+        Returns:
+            store (PoseStore): the new store
+        """
+        def sequences():
+            for txt_file in sorted(glob(os.path.join(glob_escape(txt_dir), "*.txt"))):
+                frame_ids, pose_array = self.parse_pose_txt(txt_file)
+                seq_name = os.path.basename(txt_file)[:-4]
+                yield seq_name, file_digest(txt_file), frame_ids, pose_array
+        return PoseStore.build(store_file, sequences())
+
+    def calc_sequence_errors(self, poses_gt, poses_result, gt_state=None):
         """calculate sequence error
         Args:
             poses_gt (dict): {idx: 4x4 array}, ground truth poses
             poses_result (dict): {idx: 4x4 array}, predicted poses
+            gt_state (SequenceGT): precomputed ground truth segments.
+                Computed from poses_gt if not given
         Returns:
             err (list list): [first_frame, rotation error, translation error, length, speed]
                 - first_frame: frist frame index
                 - rotation error: rotation error per length
                 - translation error: translation error per length
                 - length: evaluation trajectory length
-                - speed: car speed (#FIXME: 10FPS is assumed)
+                - speed: car speed (m/s, from self.fps)
         """
-        err = []
-        dist = self.trajectory_distances(poses_gt)
-        self.step_size = 10
-
-        for first_frame in range(0, len(poses_gt), self.step_size):
-            for i in range(self.num_lengths):
-                len_ = self.lengths[i]
-                last_frame = self.last_frame_from_segment_length(
-                                        dist, first_frame, len_
-                                        )
-
-                # Continue if sequence not long enough
-                if last_frame == -1 or \
-                        not(last_frame in poses_result.keys()) or \
-                        not(first_frame in poses_result.keys()):
-                    continue
-
-                # compute rotational and translational errors
-                pose_delta_gt = np.dot(
-                                    np.linalg.inv(poses_gt[first_frame]),
-                                    poses_gt[last_frame]
-                                    )
-                pose_delta_result = np.dot(
-                                        np.linalg.inv(poses_result[first_frame]),
-                                        poses_result[last_frame]
-                                        )
-                pose_error = np.dot(
-                                np.linalg.inv(pose_delta_result),
-                                pose_delta_gt
+        if gt_state is None:
+            gt_state = self.segment_gt(poses_gt)
+        frame_ids = np.asarray(sorted(poses_result.keys()), dtype=np.int64)
+        frames = self.index_frames(frame_ids, gt_state)
+        pred = stack_poses(poses_result, frame_ids.tolist())
+        return self.calc_sequence_errors_arrays(frames, pred, gt_state)
+
+    def calc_sequence_errors_arrays(self, frames, pred, gt_state):
+        """calculate sequence error from stacked predictions
+        Args:
+            frames (FrameIndex): predicted frames
+            pred (Nx4x4 array): predicted poses, in the order of frames.frame_ids
+            gt_state (SequenceGT): precomputed ground truth segments
+        Returns:
+            err (list list): [first_frame, rotation error, translation error, length, speed],
+                see calc_sequence_errors
+        """
+        # Continue if the segment is not in the predictions
+        valid = frames.valid[gt_state.first_frames] & frames.valid[gt_state.last_frames]
+        first_frames = gt_state.first_frames[valid]
+        last_frames = gt_state.last_frames[valid]
+        seg_lengths = gt_state.seg_lengths[valid]
+
+        if len(first_frames) == 0:
+            return []
+
+        # compute rotational and translational errors for all pairs at once;
+        # each start frame is inverted only once. np.linalg.inv matches the
+        # per-pair loop bit-for-bit and does not assume orthonormal rotations
+        invert = inverse_se3 if self.fast else np.linalg.inv
+        uniq_first, first_inv = np.unique(first_frames, return_inverse=True)
+        first_pose_inv = invert(pred[frames.pred_index[uniq_first]])[first_inv]
+        pose_delta_result = np.matmul(
+                                first_pose_inv,
+                                pred[frames.pred_index[last_frames]]
                                 )
+        pose_delta_gt = to_homogeneous(gt_state.rel_poses, np.flatnonzero(valid))
+        self.orthonormalize(pose_delta_gt, gt_state.rel_poses.dtype)
+        pose_error = np.matmul(invert(pose_delta_result), pose_delta_gt)
+        r_errs = self.rotation_error(pose_error) / seg_lengths
+        t_errs = self.translation_error(pose_error) / seg_lengths
+
+        # compute speed
+        num_frames = last_frames - first_frames + 1.0
+        speeds = seg_lengths / ((1.0/self.fps)*num_frames)
+
+        err = [list(i) for i in zip(
+                    gt_state.frame_ids[first_frames].tolist(), r_errs.tolist(), t_errs.tolist(),
+                    seg_lengths.tolist(), speeds.tolist()
+                    )]
+        return err
 
-                r_err = self.rotation_error(pose_error)
-                t_err = self.translation_error(pose_error)
-
-                # compute speed
-                num_frames = last_frame - first_frame + 1.0
-                speed = len_/(0.1*num_frames)
+    def relative_poses(self, poses, first_frames, last_frames):
+        """Compute relative poses of many segments in a batch
+        Args:
+            poses (dict / Nx3x4 array / Nx4x4 array): {idx: 4x4 array},
+                or poses in frame order
+            first_frames (int list): start-frame index of each segment
+            last_frames (int list): end-frame index of each segment
+        Returns:
+            pose_delta (Nx4x4 array): relative pose of each segment
+        """
+        # each frame is stacked and each start frame is inverted only once
+        uniq_frames, frame_idx = np.unique(
+                                    np.concatenate((first_frames, last_frames)).astype(np.int64),
+                                    return_inverse=True
+                                    )
+        first_idx = frame_idx[:len(first_frames)]
+        last_idx = frame_idx[len(first_frames):]
+        if isinstance(poses, dict):
+            pose_array = stack_poses(poses, uniq_frames)
+        else:
+            pose_array = to_homogeneous(poses, uniq_frames)
+        uniq_first, first_inv = np.unique(first_idx, return_inverse=True)
+        first_pose_inv = np.linalg.inv(pose_array[uniq_first])[first_inv]
+        pose_delta = np.matmul(
+                        first_pose_inv,
+                        pose_array[last_idx]
+                        )
+        return pose_delta
 
-                err.append([first_frame, r_err/len_, t_err/len_, len_, speed])
-        return err
-        
     def save_sequence_errors(self, err, file_name):
         """Save sequence error
+        The format follows the file extension
+            - .txt: one "first_frame r_err t_err length speed" line per segment
+            - .npz: one array per column
+            - .npy: structured array (SEGMENT_ERROR_DTYPE), memory-mappable
         Args:
             err (list list): error information
-            file_name (str): txt file for writing errors
+            file_name (str): file for writing errors
         """
-        fp = open(file_name, 'w')
-        for i in err:
-            line_to_write = " ".join([str(j) for j in i])
-            fp.writelines(line_to_write+"\n")
-        fp.close()
+        ext = os.path.splitext(file_name)[1]
+        if ext == ".npz":
+            err_array = errors_to_array(err)
+            np.savez(file_name, **{name: err_array[name] for name in err_array.dtype.names})
+        elif ext == ".npy":
+            np.save(file_name, errors_to_array(err))
+        else:
+            fp = open(file_name, 'w')
+            for i in err:
+                line_to_write = " ".join([str(j) for j in i])
+                fp.writelines(line_to_write+"\n")
+            fp.close()
+
+    def load_sequence_errors(self, file_name, mmap=True):
+        """Load sequence error saved by save_sequence_errors
+        Args:
+            file_name (str): .txt, .npz or .npy error file
+            mmap (bool): memory-map .npy files instead of reading them
+        Returns:
+            err_array (structured array): SEGMENT_ERROR_DTYPE records;
+                columns are accessed as err_array["t_err"]
+        """
+        ext = os.path.splitext(file_name)[1]
+        if ext == ".npy":
+            return np.load(file_name, mmap_mode='r' if mmap else None)
+        if ext == ".npz":
+            with np.load(file_name) as columns:
+                err_array = np.empty(len(columns["first_frame"]), dtype=SEGMENT_ERROR_DTYPE)
+                for name in SEGMENT_ERROR_DTYPE.names:
+                    err_array[name] = columns[name]
+            return err_array
+        if os.path.getsize(file_name) == 0:
+            return np.empty(0, dtype=SEGMENT_ERROR_DTYPE)
+        data = np.loadtxt(file_name, dtype=np.float64, ndmin=2).reshape(-1, 5)
+        err_array = np.empty(len(data), dtype=SEGMENT_ERROR_DTYPE)
+        for cnt, name in enumerate(SEGMENT_ERROR_DTYPE.names):
+            err_array[name] = data[:, cnt]
+        return err_array
 
     def compute_overall_err(self, seq_err):
         """Compute average translation & rotation errors
@@ -269,25 +1372,67 @@ class KittiEvalOdom():
             poses_result (dict): {idx: 4x4 array}; predicted poses
             seq (int): sequence index.
         """
-        plot_keys = ["Ground Truth", "Ours"]
+        frame_idx_list = sorted(poses_result.keys())
+        xz_gt = stack_poses(poses_gt, frame_idx_list)[:, [0, 2], 3]
+        xz_result = stack_poses(poses_result, frame_idx_list)[:, [0, 2], 3]
+        self.plot_trajectory_xz(*self.downsample_trajectories(xz_gt, xz_result), seq)
+
+    def downsample_trajectories(self, xz_gt, *xz_results):
+        """Downsample trajectories for plotting, so that plot time and file
+        size do not grow with the number of frames. The tolerance is
+        self.plot_tolerance pixels of the trajectory plot, and at most
+        self.plot_max_points vertices are drawn per trajectory
+        Args:
+            xz_gt (Nx2 array): ground truth x-z positions
+            xz_results (Nx2 arrays): predicted x-z positions of one or more methods
+        Returns:
+            xz_gt (Mx2 array): downsampled ground truth x-z positions
+            xz_results (Kx2 arrays): downsampled predicted x-z positions
+        """
+        if len(xz_gt) == 0:
+            return (xz_gt,) + xz_results
+        xz_all = np.concatenate((xz_gt,) + xz_results)
+        extent = np.max(xz_all.max(axis=0) - xz_all.min(axis=0))
+        # the trajectory plot is 10 inches wide
+        tolerance = self.plot_tolerance * extent / (10 * self.plot_dpi)
+        return tuple(
+            downsample_polyline(xz, tolerance, self.plot_max_points)
+            for xz in (xz_gt,) + xz_results
+            )
+
+    def plot_trajectory_xz(self, xz_gt, xz_result, seq):
+        """Plot trajectory for both GT and prediction from their x-z positions
+        Args:
+            xz_gt (Nx2 array): ground truth x-z positions
+            xz_result (Nx2 array): predicted x-z positions
+            seq (int): sequence index.
+        """
+        self.plot_trajectories_xz(xz_gt, {"Ours": xz_result}, seq)
+
+    def plot_trajectories_xz(self, xz_gt, xz_results, seq):
+        """Plot the GT trajectory and the trajectories of one or more
+        methods from their x-z positions
+        Args:
+            xz_gt (Nx2 array): ground truth x-z positions
+            xz_results (dict): {method name: Nx2 array}; predicted x-z positions
+            seq (int): sequence index.
+        """
+        # matplotlib is only imported when plots are requested
+        from matplotlib import pyplot as plt
+
+        plot_keys = ["Ground Truth"] + list(xz_results.keys())
         fontsize_ = 20
 
         poses_dict = {}
-        poses_dict["Ground Truth"] = poses_gt
-        poses_dict["Ours"] = poses_result
+        poses_dict["Ground Truth"] = xz_gt
+        poses_dict.update(xz_results)
 
         fig = plt.figure()
         ax = plt.gca()
         ax.set_aspect('equal')
 
         for key in plot_keys:
-            pos_xz = []
-            frame_idx_list = sorted(poses_dict["Ours"].keys())
-            for frame_idx in frame_idx_list:
-                # pose = np.linalg.inv(poses_dict[key][frame_idx_list[0]]) @ poses_dict[key][frame_idx]
-                pose = poses_dict[key][frame_idx]
-                pos_xz.append([pose[0, 3],  pose[2, 3]])
-            pos_xz = np.asarray(pos_xz)
+            pos_xz = poses_dict[key]
             plt.plot(pos_xz[:, 0],  pos_xz[:, 1], label=key)
 
         plt.legend(loc="upper right", prop={'size': fontsize_})
@@ -297,8 +1442,8 @@ class KittiEvalOdom():
         plt.ylabel('z (m)', fontsize=fontsize_)
         fig.set_size_inches(10, 10)
         png_title = "sequence_{:02}".format(seq)
-        fig_pdf = self.plot_path_dir + "/" + png_title + ".pdf"
-        plt.savefig(fig_pdf, bbox_inches='tight', pad_inches=0)
+        fig_pdf = self.plot_path_dir + "/" + png_title + "." + self.plot_format
+        plt.savefig(fig_pdf, bbox_inches='tight', pad_inches=0, dpi=self.plot_dpi)
         plt.close(fig)
 
     def plot_error(self, avg_segment_errs, seq):
@@ -308,45 +1453,87 @@ class KittiEvalOdom():
             seq (int): sequence index.
         """
         # Translation error
-        plot_y = []
-        plot_x = []
-        for len_ in self.lengths:
-            plot_x.append(len_)
-            if len(avg_segment_errs[len_]) > 0:
-                plot_y.append(avg_segment_errs[len_][0] * 100)
-            else:
-                plot_y.append(0)
-        fontsize_ = 10
-        fig = plt.figure()
-        plt.plot(plot_x, plot_y, "bs-", label="Translation Error")
-        plt.ylabel('Translation Error (%)', fontsize=fontsize_)
-        plt.xlabel('Path Length (m)', fontsize=fontsize_)
-        plt.legend(loc="upper right", prop={'size': fontsize_})
-        fig.set_size_inches(5, 5)
-        fig_pdf = self.plot_error_dir + "/trans_err_{:02}.pdf".format(seq)
-        plt.savefig(fig_pdf, bbox_inches='tight', pad_inches=0)
-        plt.close(fig)
+        self.plot_length_error(
+            [(self.length_error_curve(avg_segment_errs, 0, 100), "bs-", "Translation Error")],
+            'Translation Error (%)',
+            self.plot_error_dir + "/trans_err_{:02}.{}".format(seq, self.plot_format)
+            )
 
         # Rotation error
+        self.plot_length_error(
+            [(self.length_error_curve(avg_segment_errs, 1, 180 / np.pi * 100), "bs-", "Rotation Error")],
+            'Rotation Error (deg/100m)',
+            self.plot_error_dir + "/rot_err_{:02}.{}".format(seq, self.plot_format)
+            )
+
+    def plot_errors(self, method_segment_errs, seq):
+        """Plot per-length error of several methods into one figure
+        Args:
+            method_segment_errs (dict): {method name: avg_segment_errs}, see plot_error
+            seq (int): sequence index.
+        """
+        self.plot_length_error(
+            [(self.length_error_curve(errs, 0, 100), "s-", name)
+                for name, errs in method_segment_errs.items()],
+            'Translation Error (%)',
+            self.plot_error_dir + "/trans_err_{:02}.{}".format(seq, self.plot_format)
+            )
+        self.plot_length_error(
+            [(self.length_error_curve(errs, 1, 180 / np.pi * 100), "s-", name)
+                for name, errs in method_segment_errs.items()],
+            'Rotation Error (deg/100m)',
+            self.plot_error_dir + "/rot_err_{:02}.{}".format(seq, self.plot_format)
+            )
+
+    def length_error_curve(self, avg_segment_errs, column, unit_scale):
+        """Average error of every segment length, 0 for lengths without segments
+        Args:
+            avg_segment_errs (dict): {100:[avg_t_err, avg_r_err],...}
+            column (int): 0 for the translation error, 1 for the rotation error
+            unit_scale (float): scale of the errors
+        Returns:
+            plot_y (list): error of each length of self.lengths
+        """
         plot_y = []
-        plot_x = []
         for len_ in self.lengths:
-            plot_x.append(len_)
             if len(avg_segment_errs[len_]) > 0:
-                plot_y.append(avg_segment_errs[len_][1] / np.pi * 180 * 100)
+                plot_y.append(avg_segment_errs[len_][column] * unit_scale)
             else:
                 plot_y.append(0)
+        return plot_y
+
+    def plot_length_error(self, curves, ylabel, fig_pdf):
+        """Plot error curves over the segment lengths
+        Args:
+            curves (list): [(plot_y, style, label), ...]; one curve per line
+            ylabel (str): label of the error axis
+            fig_pdf (str): file path of the figure
+        """
+        from matplotlib import pyplot as plt
+
         fontsize_ = 10
         fig = plt.figure()
-        plt.plot(plot_x, plot_y, "bs-", label="Rotation Error")
-        plt.ylabel('Rotation Error (deg/100m)', fontsize=fontsize_)
+        for plot_y, style, label in curves:
+            plt.plot(self.lengths, plot_y, style, label=label)
+        plt.ylabel(ylabel, fontsize=fontsize_)
         plt.xlabel('Path Length (m)', fontsize=fontsize_)
         plt.legend(loc="upper right", prop={'size': fontsize_})
         fig.set_size_inches(5, 5)
-        fig_pdf = self.plot_error_dir + "/rot_err_{:02}.pdf".format(seq)
-        plt.savefig(fig_pdf, bbox_inches='tight', pad_inches=0)
+        plt.savefig(fig_pdf, bbox_inches='tight', pad_inches=0, dpi=self.plot_dpi)
         plt.close(fig)
 
+    def plot_sequence(self, seq, xz_gt, xz_result, avg_segment_errs):
+        """Plot trajectory and per-length error of a sequence.
+        Called in the plotting process when plots are rendered in background.
+        Args:
+            seq (int): sequence index
+            xz_gt (Nx2 array): ground truth x-z positions
+            xz_result (Nx2 array): predicted x-z positions
+            avg_segment_errs (dict): {100:[avg_t_err, avg_r_err],...}
+        """
+        self.plot_trajectory_xz(xz_gt, xz_result, seq)
+        self.plot_error(avg_segment_errs, seq)
+
     def compute_segment_error(self, seq_errs):
         """This function calculates average errors for different segment.
         Args:
@@ -355,7 +1542,7 @@ class KittiEvalOdom():
                 - rotation error: rotation error per length
                 - translation error: translation error per length
                 - length: evaluation trajectory length
-                - speed: car speed (#FIXME: 10FPS is assumed)
+                - speed: car speed (m/s, from self.fps)
         Returns:
             avg_segment_errs (dict): {100:[avg_t_err, avg_r_err],...}    
         """
@@ -382,38 +1569,67 @@ class KittiEvalOdom():
                 avg_segment_errs[len_] = []
         return avg_segment_errs
 
+    def segment_error_sums(self, seq_errs):
+        """Number of segments and sums of their errors for every segment length.
+        Sums of several sequences add up to segment-weighted averages,
+        e.g. the overall error of the KITTI devkit
+        Args:
+            seq_errs (list list): segment errors, see compute_segment_error
+        Returns:
+            sums (Lx3 array): [num_segments, sum of t_err, sum of r_err]
+                of each length of self.lengths
+        """
+        err_array = errors_to_array(seq_errs)
+        lengths = np.asarray(self.lengths, dtype=np.float64)
+        order = np.argsort(lengths)
+        len_idx = order[np.searchsorted(lengths[order], err_array["length"])]
+        sums = np.empty((len(lengths), 3))
+        sums[:, 0] = np.bincount(len_idx, minlength=len(lengths))
+        sums[:, 1] = np.bincount(len_idx, weights=err_array["t_err"], minlength=len(lengths))
+        sums[:, 2] = np.bincount(len_idx, weights=err_array["r_err"], minlength=len(lengths))
+        return sums
+
     def compute_ATE(self, gt, pred):
         """Compute RMSE of ATE
         Args:
             gt (4x4 array dict): ground-truth poses
             pred (4x4 array dict): predicted poses
+        Returns:
+            ate (float): RMSE of ATE
         """
-        errors = []
-        idx_0 = list(pred.keys())[0]
-        gt_0 = gt[idx_0]
-        pred_0 = pred[idx_0]
+        frame_ids = list(pred.keys())
+        return self.compute_ATE_arrays(stack_poses(gt, frame_ids), stack_poses(pred, frame_ids))
 
-        for i in pred:
-            # cur_gt = np.linalg.inv(gt_0) @ gt[i]
-            cur_gt = gt[i]
-            gt_xyz = cur_gt[:3, 3] 
-
-            # cur_pred = np.linalg.inv(pred_0) @ pred[i]
-            cur_pred = pred[i]
-            pred_xyz = cur_pred[:3, 3]
+    def compute_ATE_arrays(self, gt, pred):
+        """Compute RMSE of ATE from stacked poses
+        Args:
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses of the same frames
+        Returns:
+            ate (float): RMSE of ATE
+        """
+        errors = self.ate_errors(gt, pred)
+        ate = np.sqrt(np.mean(errors ** 2))
+        return ate
 
-            align_err = gt_xyz - pred_xyz
+    def ate_errors(self, gt, pred):
+        """Compute absolute translation error of every predicted frame
+        Args:
+            gt (Nx4x4 array / 4x4 array dict): ground-truth poses
+            pred (Nx4x4 array / 4x4 array dict): predicted poses
+        Returns:
+            errors (N array): translation error of each frame
+        """
+        if isinstance(pred, dict):
+            frame_ids = list(pred.keys())
+            gt = stack_poses(gt, frame_ids)
+            pred = stack_poses(pred, frame_ids)
+        align_err = gt[:, :3, 3] - pred[:, :3, 3]
+        errors = np.sqrt(np.sum(align_err ** 2, axis=1))
+        return errors
 
-            # print('i: ', i)
-            # print("gt: ", gt_xyz)
-            # print("pred: ", pred_xyz)
-            # input("debug")
-            errors.append(np.sqrt(np.sum(align_err ** 2)))
-        ate = np.sqrt(np.mean(np.asarray(errors) ** 2)) 
-        return ate
-    
     def compute_RPE(self, gt, pred):
-        """Compute RPE
+        """Compute RPE between consecutive frames
         Args:
             gt (4x4 array dict): ground-truth poses
             pred (4x4 array dict): predicted poses
@@ -421,25 +1637,126 @@ class KittiEvalOdom():
             rpe_trans
             rpe_rot
         """
-        trans_errors = []
-        rot_errors = []
-        for i in list(pred.keys())[:-1]:
-            gt1 = gt[i]
-            gt2 = gt[i+1]
-            gt_rel = np.linalg.inv(gt1) @ gt2
-
-            pred1 = pred[i]
-            pred2 = pred[i+1]
-            pred_rel = np.linalg.inv(pred1) @ pred2
-            rel_err = np.linalg.inv(gt_rel) @ pred_rel
-            
-            trans_errors.append(self.translation_error(rel_err))
-            rot_errors.append(self.rotation_error(rel_err))
-        # rpe_trans = np.sqrt(np.mean(np.asarray(trans_errors) ** 2))
-        # rpe_rot = np.sqrt(np.mean(np.asarray(rot_errors) ** 2))
-        rpe_trans = np.mean(np.asarray(trans_errors))
-        rpe_rot = np.mean(np.asarray(rot_errors))
-        return rpe_trans, rpe_rot
+        frame_ids = np.asarray(sorted(pred.keys()), dtype=np.int64)
+        return self.compute_RPE_arrays(
+                    frame_ids,
+                    stack_poses(gt, frame_ids.tolist()),
+                    stack_poses(pred, frame_ids.tolist())
+                    )
+
+    def compute_RPE_arrays(self, frame_ids, gt, pred):
+        """Compute RPE between consecutive frames from stacked poses.
+        Pairs are consecutive predicted frames, so keyframe-only predictions
+        are evaluated between their keyframes
+        Args:
+            frame_ids (N int array): sorted frame indexs
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses
+        Returns:
+            rpe_trans
+            rpe_rot
+        """
+        trans_errs, rot_errs = self.rpe_errors(gt, pred)
+        return error_statistics(trans_errs)["mean"], error_statistics(rot_errs)["mean"]
+
+    def rpe_inverses(self, gt, pred):
+        """Inverted poses shared by the RPE of all frame pairs,
+        see compute_RPE_deltas_arrays
+        Args:
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses
+        Returns:
+            gt_inv (Nx4x4 array): inv(gt_i)
+            gt_pred_inv (Nx4x4 array): gt_i @ inv(pred_i)
+        """
+        gt_inv = np.linalg.inv(gt)
+        gt_pred_inv = np.matmul(gt, np.linalg.inv(pred))
+        return gt_inv, gt_pred_inv
+
+    def rpe_errors(self, gt, pred, inverses=None):
+        """Compute RPE of every pair of consecutive predicted frames
+        Args:
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses
+            inverses (tuple/None): rpe_inverses of gt and pred. Computed if None
+        Returns:
+            trans_errs (N-1 array): translation error of each pair (m)
+            rot_errs (N-1 array): rotation error of each pair (rad)
+        """
+        # rel_err = inv(gt_j) @ (gt_i @ inv(pred_i)) @ pred_j, see compute_RPE_deltas
+        gt_inv, gt_pred_inv = self.rpe_inverses(gt, pred) if inverses is None else inverses
+        rel_err = np.matmul(np.matmul(gt_inv[1:], gt_pred_inv[:-1]), pred[1:])
+        return self.translation_error(rel_err), self.rotation_error(rel_err)
+
+    def compute_RPE_deltas(self, gt, pred, deltas, delta_unit="frame"):
+        """Compute RPE for several frame or distance deltas in one pass.
+        Poses are inverted once and shared by all deltas.
+        Args:
+            gt (4x4 array dict): ground-truth poses
+            pred (4x4 array dict): predicted poses
+            deltas (list): deltas between the frames of a pair
+            delta_unit (str): unit of deltas
+                - frame: pairs (i, i+delta) of frame indexs
+                - m: pairs (i, j) with j the first frame whose GT trajectory
+                  distance from i is at least delta meters
+        Returns:
+            rpe_stats (dict): {delta: {"num_pairs": int,
+                                       "trans": {mean, rmse, median, max} (m),
+                                       "rot": {mean, rmse, median, max} (rad)}}
+        """
+        frame_ids = np.asarray(sorted(pred.keys()), dtype=np.int64)
+        return self.compute_RPE_deltas_arrays(
+                    frame_ids,
+                    stack_poses(gt, frame_ids.tolist()),
+                    stack_poses(pred, frame_ids.tolist()),
+                    deltas, delta_unit
+                    )
+
+    def compute_RPE_deltas_arrays(self, frame_ids, gt_array, pred_array, deltas,
+                                    delta_unit="frame", inverses=None):
+        """Compute RPE for several deltas from stacked poses, see compute_RPE_deltas
+        Args:
+            frame_ids (N int array): sorted frame indexs
+            gt_array (Nx4x4 array): ground-truth poses
+            pred_array (Nx4x4 array): predicted poses
+            deltas (list): deltas between the frames of a pair
+            delta_unit (str): unit of deltas, frame or m
+            inverses (tuple/None): rpe_inverses of gt_array and pred_array,
+                e.g. shared with rpe_errors. Computed if None
+        Returns:
+            rpe_stats (dict): {delta: {"num_pairs": int, "trans": {...}, "rot": {...}}}
+        """
+        # rel_err = inv(inv(gt_i) @ gt_j) @ inv(pred_i) @ pred_j
+        #         = inv(gt_j) @ (gt_i @ inv(pred_i)) @ pred_j
+        if inverses is None:
+            inverses = self.rpe_inverses(gt_array, pred_array)
+        gt_inv, gt_pred_inv = inverses
+        if delta_unit == "m":
+            dist = self.trajectory_distances(gt_array)
+
+        rpe_stats = {}
+        for delta in deltas:
+            if delta_unit == "frame":
+                first = np.arange(len(frame_ids))
+                last = np.searchsorted(frame_ids, frame_ids + delta)
+                valid = last < len(frame_ids)
+                valid[valid] = frame_ids[last[valid]] == frame_ids[valid] + delta
+            elif delta_unit == "m":
+                first = np.arange(len(frame_ids))
+                last = np.searchsorted(dist, dist + delta, side='left')
+                valid = (last < len(frame_ids)) & (last > first)
+            else:
+                raise ValueError("Unknown delta unit: {}".format(delta_unit))
+            first = first[valid]
+            last = last[valid]
+
+            rel_err = np.matmul(np.matmul(gt_inv[last], gt_pred_inv[first]), pred_array[last])
+            rpe_stats[delta] = {
+                "num_pairs": len(first),
+                "trans": error_statistics(self.translation_error(rel_err)),
+                "rot": error_statistics(self.rotation_error(rel_err)),
+            }
+        return rpe_stats
 
     def scale_optimization(self, gt, pred):
         """ Optimize scaling factor
@@ -449,27 +1766,25 @@ class KittiEvalOdom():
         Returns:
             new_pred (4x4 array dict): predicted poses after optimization
         """
-        pred_updated = copy.deepcopy(pred)
-        xyz_pred = []
-        xyz_ref = []
-        for i in pred:
-            pose_pred = pred[i]
-            pose_ref = gt[i]
-            xyz_pred.append(pose_pred[:3, 3])
-            xyz_ref.append(pose_ref[:3, 3])
-        xyz_pred = np.asarray(xyz_pred)
-        xyz_ref = np.asarray(xyz_ref)
-        scale = scale_lse_solver(xyz_pred, xyz_ref)
-        for i in pred_updated:
-            pred_updated[i][:3, 3] *= scale
+        frame_ids = list(pred.keys())
+        pred_array = stack_poses(pred, frame_ids)
+        xyz_ref = stack_poses(gt, frame_ids)[:, :3, 3]
+        scale = scale_lse_solver(pred_array[:, :3, 3], xyz_ref)
+        pred_array[:, :3, 3] *= scale
+        pred_updated = dict(zip(frame_ids, pred_array))
         return pred_updated
     
-    def write_result(self, f, seq, errs):
+    def write_result(self, f, seq, errs, rpe_stats=None, confidence_intervals=None,
+                        local_ate=None):
         """Write result into a txt file
         Args:
             f (IOWrapper)
             seq (int): sequence number
             errs (list): [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]
+            rpe_stats (dict): RPE statistics of extra deltas, see compute_RPE_deltas
+            confidence_intervals (dict): bootstrap confidence intervals,
+                see compute_confidence_intervals
+            local_ate (dict): ATE of separately aligned windows, see compute_local_ATE
         """
         ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot = errs
         lines = []
@@ -478,14 +1793,53 @@ class KittiEvalOdom():
         lines.append("Rot. err. (deg/100m): \t {:.3f} \n".format(ave_r_err/np.pi*180*100))
         lines.append("ATE (m): \t {:.3f} \n".format(ate))
         lines.append("RPE (m): \t {:.3f} \n".format(rpe_trans))
-        lines.append("RPE (deg): \t {:.3f} \n\n".format(rpe_rot * 180 /np.pi))
+        lines.append("RPE (deg): \t {:.3f} \n".format(rpe_rot * 180 /np.pi))
+        if rpe_stats is not None:
+            for delta, stats in rpe_stats.items():
+                name = "RPE@{:g}{}".format(delta, self.rpe_delta_unit)
+                lines.append("{} (m) mean/rmse/median/max: \t {:.3f} / {:.3f} / {:.3f} / {:.3f} \n".format(
+                                name, *[stats["trans"][k] for k in ["mean", "rmse", "median", "max"]]))
+                lines.append("{} (deg) mean/rmse/median/max: \t {:.3f} / {:.3f} / {:.3f} / {:.3f} \n".format(
+                                name, *[stats["rot"][k] * 180 / np.pi for k in ["mean", "rmse", "median", "max"]]))
+        if confidence_intervals is not None:
+            level = "{:g}% CI".format(self.confidence * 100)
+            for name, key, scale in [
+                    ("Trans. err. (%)", "t_err", 100),
+                    ("Rot. err. (deg/100m)", "r_err", 180 / np.pi * 100),
+                    ("ATE (m)", "ate", 1),
+                    ("RPE (m)", "rpe_trans", 1),
+                    ("RPE (deg)", "rpe_rot", 180 / np.pi)]:
+                lower, upper = confidence_intervals[key]
+                lines.append("{} {}: \t [{:.3f}, {:.3f}] \n".format(name, level, lower * scale, upper * scale))
+        if local_ate is not None:
+            name = "Local ATE@{:g}{} {}".format(self.local_window, self.local_window_unit, self.local_alignment)
+            lines.append("{} (m) mean/rmse/median/max: \t {:.3f} / {:.3f} / {:.3f} / {:.3f} \n".format(
+                            name, *[local_ate["stats"][k] for k in ["mean", "rmse", "median", "max"]]))
+        lines.append("\n")
         for line in lines:
             f.writelines(line)
 
 
     def eval(self, gt_dir, result_dir, 
                 alignment=None,
-                seqs=None):
+                seqs=None,
+                workers=1,
+                plot=True,
+                profile=None,
+                rpe_deltas=None,
+                rpe_delta_unit="frame",
+                error_format="txt",
+                plot_async=False,
+                plot_format="pdf",
+                cache=None,
+                bootstrap=0,
+                bootstrap_block=None,
+                confidence=0.95,
+                local_window=None,
+                local_window_step=None,
+                local_window_unit="frame",
+                local_alignment="7dof",
+                export=None):
         """Evaulate required/available sequences
         Args:
             gt_dir (str): ground truth poses txt files directory
@@ -498,11 +1852,68 @@ class KittiEvalOdom():
             seqs (list/None):
                 - None: Evalute all available seqs in result_dir
                 - list: list of sequence indexs to be evaluated
+            workers (int): number of processes evaluating sequences in parallel
+            plot (bool): plot trajectories and per-length errors
+            profile (str/None): extra profiling besides the stage timings
+                saved in timing.json
+                - cprofile: cProfile each sequence, saved as profile_XX.prof
+                - tracemalloc: peak memory of each stage
+            rpe_deltas (list/None): if not None, RPE statistics of these
+                deltas are also written into result.txt
+            rpe_delta_unit (str): unit of rpe_deltas, frame or m
+            error_format (str): format of the segment errors in errors/,
+                see save_sequence_errors
+                - txt: errors/XX.txt text file
+                - npz: errors/XX.npz, one array per column
+                - npy: errors/XX.npy, memory-mappable structured array
+            plot_async (bool): render plots in a background process, so that
+                metrics and result.txt do not wait for them. eval returns
+                after all plots are written. Scripts using it have to guard
+                their entry point with if __name__ == "__main__"; plots are
+                rendered inline if the process cannot start
+            plot_format (str): pdf (vector) or png (raster) plots
+            cache (ResultCache/None): if given, sequences whose prediction,
+                ground truth and parameters are unchanged are restored from
+                the cache instead of being evaluated, and existing plots
+                are not rendered again
+            bootstrap (int): number of bootstrap resamples for confidence
+                intervals of the metrics in result.txt. Disabled if 0
+            bootstrap_block (int/None): number of frames of a bootstrap block.
+                If None, the longest ground-truth segment span of the
+                sequence, so that overlapping segments fall into neighbouring
+                blocks
+            confidence (float): confidence level of the intervals
+            local_window (float/None): if not None, every window of this many
+                frames (or meters) is aligned separately and the statistics
+                of the window ATE are written into result.txt
+            local_window_step (float/None): distance between window starts;
+                local_window (non-overlapping windows) if None
+            local_window_unit (str): unit of the window, frame or m
+            local_alignment (str): alignment of each window, 7dof or 6dof
+            export (list/None): machine-readable copies of all per-sequence
+                and overall metrics, see export_results
+                - json: RESULT_PATH/result.json
+                - csv: RESULT_PATH/result.csv
+        Returns:
+            seq_results (dict): {seq: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}
         """
-        seq_list = ["{:02}".format(i) for i in range(0, 11)]
+        eval_start = time.perf_counter()
+        self.error_format = error_format
+        self.rpe_deltas = rpe_deltas
+        self.rpe_delta_unit = rpe_delta_unit
+        self.plot_async = plot and plot_async
+        self.plot_format = plot_format
+        self.result_cache = cache
+        self.bootstrap_resamples = bootstrap
+        self.bootstrap_block = bootstrap_block
+        self.confidence = confidence
+        self.local_window = local_window
+        self.local_window_step = local_window_step
+        self.local_window_unit = local_window_unit
+        self.local_alignment = local_alignment
 
         # Initialization
-        self.gt_dir = gt_dir
+        self.open_gt(gt_dir)
         ave_t_errs = []
         ave_r_errs = []
         seq_ate = []
@@ -510,103 +1921,126 @@ class KittiEvalOdom():
         seq_rpe_rot = []
 
         # Create result directory
-        error_dir = result_dir + "/errors"
+        self.error_dir = result_dir + "/errors"
         self.plot_path_dir = result_dir + "/plot_path"
         self.plot_error_dir = result_dir + "/plot_error"
         result_txt = os.path.join(result_dir, "result.txt")
         f = open(result_txt, 'w')
 
-        if not os.path.exists(error_dir):
-            os.makedirs(error_dir)
-        if not os.path.exists(self.plot_path_dir):
+        if not os.path.exists(self.error_dir):
+            os.makedirs(self.error_dir)
+        if plot and not os.path.exists(self.plot_path_dir):
             os.makedirs(self.plot_path_dir)
-        if not os.path.exists(self.plot_error_dir):
+        if plot and not os.path.exists(self.plot_error_dir):
             os.makedirs(self.plot_error_dir)
 
         # Create evaluation list
         if seqs is None:
-            available_seqs = sorted(glob(os.path.join(result_dir, "*.txt")))
-            self.eval_seqs = [int(i[-6:-4]) for i in available_seqs if i[-6:-4] in seq_list]
+            self.eval_seqs = self.find_seqs([result_dir])
         else:
             self.eval_seqs = seqs
 
-        # evaluation
-        for i in self.eval_seqs:
-            self.cur_seq = i
-            # Read pose txt
-            self.cur_seq = '{:02}'.format(i)
-            file_name = '{:02}.txt'.format(i)
-
-            poses_result = self.load_poses_from_txt(result_dir+"/"+file_name)
-            poses_gt = self.load_poses_from_txt(self.gt_dir + "/" + file_name)
-            self.result_file_name = result_dir+file_name
-
-            # Pose alignment to first frame
-            idx_0 = sorted(list(poses_result.keys()))[0]
-            pred_0 = poses_result[idx_0]
-            gt_0 = poses_gt[idx_0]
-            for cnt in poses_result:
-                poses_result[cnt] = np.linalg.inv(pred_0) @ poses_result[cnt]
-                poses_gt[cnt] = np.linalg.inv(gt_0) @ poses_gt[cnt]
-
-            if alignment == "scale":
-                poses_result = self.scale_optimization(poses_gt, poses_result)
-            elif alignment == "scale_7dof" or alignment == "7dof" or alignment == "6dof":
-                # get XYZ
-                xyz_gt = []
-                xyz_result = []
-                for cnt in poses_result:
-                    xyz_gt.append([poses_gt[cnt][0, 3], poses_gt[cnt][1, 3], poses_gt[cnt][2, 3]])
-                    xyz_result.append([poses_result[cnt][0, 3], poses_result[cnt][1, 3], poses_result[cnt][2, 3]])
-                xyz_gt = np.asarray(xyz_gt).transpose(1, 0)
-                xyz_result = np.asarray(xyz_result).transpose(1, 0)
-
-                r, t, scale = umeyama_alignment(xyz_result, xyz_gt, alignment!="6dof")
-
-                align_transformation = np.eye(4)
-                align_transformation[:3:, :3] = r
-                align_transformation[:3, 3] = t
-                
-                for cnt in poses_result:
-                    poses_result[cnt][:3, 3] *= scale
-                    if alignment=="7dof" or alignment=="6dof":
-                        poses_result[cnt] = align_transformation @ poses_result[cnt]
-
-            # compute sequence errors
-            seq_err = self.calc_sequence_errors(poses_gt, poses_result)
-            self.save_sequence_errors(seq_err, error_dir + "/" + file_name)
-
-            # Compute segment errors
-            avg_segment_errs = self.compute_segment_error(seq_err)
-
-            # compute overall error
-            ave_t_err, ave_r_err = self.compute_overall_err(seq_err)
+        # evaluation; results are gathered in the order of self.eval_seqs
+        main_timer = StageTimer(memory=profile == "tracemalloc")
+        cache_keys = [None] * len(self.eval_seqs)
+        if cache is not None:
+            with main_timer.stage("cache_lookup"):
+                cache_keys = [self.cache_key(i, result_dir, alignment) for i in self.eval_seqs]
+        parallel = workers > 1 and len(self.eval_seqs) > 1
+        if parallel:
+            # each worker loads and segments the ground truth of its own
+            # sequences, so that GT preparation runs in parallel as well;
+            # workers of a batch keep it for later runs
+            gt_states = [None] * len(self.eval_seqs)
+        else:
+            with main_timer.stage("prepare_gt"):
+                # ground truth is not needed by cached sequences
+                gt_states = [
+                    None if key is not None and os.path.exists(cache.entry_file(key))
+                    else self.prepare_gt(i)
+                    for i, key in zip(self.eval_seqs, cache_keys)
+                    ]
+        seq_args = (self.eval_seqs, repeat(result_dir), repeat(alignment), gt_states,
+                        repeat(plot), repeat(profile), cache_keys)
+        executor = None
+        if parallel:
+            executor = self.worker_pool
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=min(workers, len(self.eval_seqs)))
+            seq_results = executor.map(self.profile_seq, *seq_args)
+        else:
+            seq_results = map(self.profile_seq, *seq_args)
+        # a single plotting process; matplotlib is not thread-safe
+        plot_executor = ProcessPoolExecutor(max_workers=1) if self.plot_async else None
+        plot_futures = []
+
+        results = {}
+        seq_timings = {}
+        seq_reports = {}
+        for i, (errs, seq_timing, report, plot_job) in zip(self.eval_seqs, seq_results):
+            if plot_job is not None:
+                try:
+                    plot_futures.append((plot_executor.submit(self.plot_sequence, *plot_job), plot_job))
+                except BrokenProcessPool:
+                    # the plotting process could not start; plot inline
+                    self.plot_sequence(*plot_job)
+            results[i] = errs
+            seq_timings['{:02}'.format(i)] = seq_timing
+            ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot = errs
             print("Sequence: " + str(i))
             print("Translational error (%): ", ave_t_err*100)
             print("Rotational error (deg/100m): ", ave_r_err/np.pi*180*100)
+            print("ATE (m): ", ate)
+            print("RPE (m): ", rpe_trans)
+            print("RPE (deg): ", rpe_rot * 180 /np.pi)
             ave_t_errs.append(ave_t_err)
             ave_r_errs.append(ave_r_err)
-
-            # Compute ATE
-            ate = self.compute_ATE(poses_gt, poses_result)
             seq_ate.append(ate)
-            print("ATE (m): ", ate)
-
-            # Compute RPE
-            rpe_trans, rpe_rot = self.compute_RPE(poses_gt, poses_result)
             seq_rpe_trans.append(rpe_trans)
             seq_rpe_rot.append(rpe_rot)
-            print("RPE (m): ", rpe_trans)
-            print("RPE (deg): ", rpe_rot * 180 /np.pi)
-
-            # Plotting
-            self.plot_trajectory(poses_gt, poses_result, i)
-            self.plot_error(avg_segment_errs, i)
 
             # Save result summary
-            self.write_result(f, i, [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot])
-            
+            with main_timer.stage("write_result"):
+                self.write_result(
+                    f, i, errs,
+                    rpe_stats=report["rpe_stats"],
+                    confidence_intervals=report["confidence_intervals"],
+                    local_ate=report["local_ate"]
+                    )
+                f.flush()
+            report["num_frames"] = seq_timing.get("num_frames", 0)
+            seq_reports[i] = report
+
+        if executor is not None and executor is not self.worker_pool:
+            executor.shutdown()
         f.close()    
+        if plot_executor is not None:
+            with main_timer.stage("plot_wait"):
+                plot_executor.shutdown()
+                for future, plot_job in plot_futures:
+                    try:
+                        # raise errors of the plotting process
+                        future.result()
+                    except BrokenProcessPool:
+                        # the plotting process could not start (e.g. a
+                        # spawned child failed to import the caller); plot inline
+                        self.plot_sequence(*plot_job)
+        if cache is not None:
+            with main_timer.stage("cache_evict"):
+                cache.evict()
+        if export:
+            with main_timer.stage("export"):
+                self.export_results(
+                    os.path.join(result_dir, "result"),
+                    results, seq_reports, export, alignment
+                    )
+        main_timer.close()
+        self.save_timing(
+            os.path.join(result_dir, "timing.json"),
+            main_timer, seq_timings,
+            time.perf_counter() - eval_start,
+            workers=workers, profile=profile
+            )
 
         print("-------------------- For Copying ------------------------------")
         for i in range(len(ave_t_errs)):
@@ -615,3 +2049,1027 @@ class KittiEvalOdom():
             print("{0:.2f}".format(seq_ate[i]))
             print("{0:.3f}".format(seq_rpe_trans[i]))
             print("{0:.3f}".format(seq_rpe_rot[i] * 180 / np.pi))
+        return results
+
+    def eval_batch(self, gt_dir, result_dirs, leaderboard_csv=None, **eval_kwargs):
+        """Evaluate many result directories against the same ground truth.
+        Ground truth of each sequence is loaded and segmented only once
+        and reused for every result directory. With workers > 1, one process
+        pool serves the whole batch and every worker keeps the ground truth
+        it prepared, so each worker prepares a sequence at most once.
+        Args:
+            gt_dir (str): ground truth poses txt files directory
+            result_dirs (str/list): result directory, glob pattern or a list of them
+            leaderboard_csv (str): csv file summarizing all results. Skipped if None
+            eval_kwargs: options passed to eval for every result directory
+                (alignment, seqs, workers, plot, export, ...)
+        Returns:
+            batch_results (dict): {result_dir: {seq: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}}
+        """
+        batch_results = {}
+        workers = eval_kwargs.get("workers", 1)
+        if workers > 1:
+            self.worker_pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            for result_dir in self.find_result_dirs(result_dirs):
+                batch_results[result_dir] = self.eval(gt_dir, result_dir, **eval_kwargs)
+        finally:
+            if self.worker_pool is not None:
+                self.worker_pool.shutdown()
+                self.worker_pool = None
+
+        if leaderboard_csv is not None:
+            self.write_leaderboard(batch_results, leaderboard_csv)
+        return batch_results
+
+    def find_result_dirs(self, result_dirs):
+        """Expand result directories and glob patterns
+        Args:
+            result_dirs (str/list): result directory, glob pattern or a list of them
+        Returns:
+            run_dirs (list): existing result directories, without duplicates
+        """
+        if isinstance(result_dirs, str):
+            result_dirs = [result_dirs]
+        run_dirs = []
+        for pattern in result_dirs:
+            for result_dir in sorted(glob(pattern)):
+                if os.path.isdir(result_dir) and result_dir not in run_dirs:
+                    run_dirs.append(result_dir)
+        return run_dirs
+
+    def find_seqs(self, result_dirs):
+        """Find the sequences with a result in any of the result directories.
+        Sequences are the KITTI sequences 00 ... 10, or the numbered
+        sequences of the ground truth PoseStore
+        Args:
+            result_dirs (list): pose predictions txt files directories
+        Returns:
+            seqs (list): sorted sequence indexs
+        """
+        if self.gt_store is not None:
+            seq_list = [name for name in self.gt_store.index
+                            if name.isdigit() and name == '{:02}'.format(int(name))]
+        else:
+            seq_list = ["{:02}".format(i) for i in range(0, 11)]
+        seq_list = set(seq_list)
+        seqs = set()
+        for result_dir in result_dirs:
+            for txt_file in glob(os.path.join(glob_escape(result_dir), "*.txt")):
+                seq_name = os.path.basename(txt_file)[:-4]
+                if seq_name in seq_list:
+                    seqs.add(int(seq_name))
+        return sorted(seqs)
+
+    def compare(self, gt_dir, result_dirs, output_dir,
+                    names=None,
+                    alignment=None,
+                    seqs=None,
+                    workers=1,
+                    plot=True,
+                    plot_format="pdf"):
+        """Compare several methods (result directories) in one run.
+        Ground truth of each sequence is loaded and segmented once, and the
+        GT poses of the predicted frames are gathered once for all methods
+        predicting the same frames. The trajectories and per-length errors
+        of all methods are overlaid in one plot per sequence, and the
+        metrics are written into one table:
+            - output_dir/comparison.txt: one table per sequence and the
+              mean over the sequences
+            - output_dir/comparison.csv: one row per sequence and method
+        Args:
+            gt_dir (str): ground truth poses txt files directory
+            result_dirs (str/list): result directories or glob patterns, one per method
+            output_dir (str): directory of the comparison table and plots
+            names (list/None): method names; names of the result directories if None
+            alignment (str): alignment type, see eval
+            seqs (list/None): sequences to be compared. All sequences with
+                a result of any method if None
+            workers (int): number of processes comparing sequences in parallel
+            plot (bool): plot trajectories and per-length errors
+            plot_format (str): pdf or png plots
+        Returns:
+            compare_results (dict): {seq: {method name: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}}
+        """
+        run_dirs = self.find_result_dirs(result_dirs)
+        if names is None:
+            names = [os.path.basename(os.path.normpath(i)) for i in run_dirs]
+            if len(set(names)) < len(names):
+                names = run_dirs
+        elif len(names) != len(run_dirs):
+            raise ValueError("Got {} names for {} result directories".format(
+                                len(names), len(run_dirs)))
+        methods = dict(zip(names, run_dirs))
+
+        self.open_gt(gt_dir)
+        self.plot_format = plot_format
+        self.plot_path_dir = output_dir + "/plot_path"
+        self.plot_error_dir = output_dir + "/plot_error"
+        os.makedirs(output_dir, exist_ok=True)
+        if plot:
+            os.makedirs(self.plot_path_dir, exist_ok=True)
+            os.makedirs(self.plot_error_dir, exist_ok=True)
+
+        if seqs is None:
+            seqs = self.find_seqs(run_dirs)
+
+        seq_args = (seqs, repeat(methods), repeat(alignment), repeat(plot))
+        executor = None
+        if workers > 1 and len(seqs) > 1:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(seqs)))
+            seq_results = executor.map(self.compare_seq, *seq_args)
+        else:
+            seq_results = map(self.compare_seq, *seq_args)
+
+        compare_results = {}
+        for seq, (method_errs, plot_job) in zip(seqs, seq_results):
+            compare_results[seq] = method_errs
+            if plot_job is not None:
+                self.plot_comparison(*plot_job)
+        if executor is not None:
+            executor.shutdown()
+
+        table = self.comparison_table(compare_results, names)
+        print(table, end="")
+        with open(os.path.join(output_dir, "comparison.txt"), 'w') as f:
+            f.write(table)
+        self.write_comparison_csv(compare_results, os.path.join(output_dir, "comparison.csv"))
+        return compare_results
+
+    def compare_seq(self, seq, methods, alignment=None, plot=True):
+        """Evaluate the results of several methods on one sequence
+        Args:
+            seq (int): sequence index
+            methods (dict): {method name: result directory}; methods without
+                a result of the sequence are skipped
+            alignment (str): alignment type, see eval
+            plot (bool): return the downsampled trajectories for plotting
+        Returns:
+            method_errs (dict): {method name: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}
+            plot_job (tuple/None): arguments of plot_comparison
+        """
+        file_name = '{:02}.txt'.format(seq)
+        gt_state = self.prepare_gt(seq)
+
+        # GT poses of the predicted frames, shared by methods predicting the same frames
+        shared_gt = {}
+        method_errs = {}
+        method_segment_errs = {}
+        xz_gt = None
+        xz_results = {}
+        for name, result_dir in methods.items():
+            result_file = os.path.join(result_dir, file_name)
+            if not os.path.exists(result_file):
+                continue
+            # named in the errors of index_frames
+            self.cur_seq = '{:02} ({})'.format(seq, name)
+            frame_ids, pose_array = self.load_pose_array(result_file)
+            pose_array = pose_array.astype(self.pose_dtype, copy=False)
+            frame_ids, pose_array = self.sort_frames(frame_ids, pose_array)
+            frame_key = frame_ids.tobytes()
+            if frame_key not in shared_gt:
+                frames = self.index_frames(frame_ids, gt_state)
+                pred, gt = self.gather_poses(frames, pose_array, gt_state)
+                shared_gt[frame_key] = (frames, gt)
+            else:
+                frames, gt = shared_gt[frame_key]
+                pred = to_homogeneous(pose_array)
+                self.orthonormalize(pred, pose_array.dtype)
+            del pose_array
+
+            # compute_metrics normalizes the GT poses in place
+            metrics = self.compute_metrics(frames, pred, gt.copy(), gt_state, alignment)
+            method_errs[name] = metrics.errs()
+            method_segment_errs[name] = metrics.avg_segment_errs
+            if plot:
+                if xz_gt is None or len(frames.frame_ids) > len(xz_gt):
+                    # GT of the method predicting most frames
+                    idx_0 = np.argmin(frames.frame_ids)
+                    xz_gt = np.matmul(np.linalg.inv(gt[idx_0]), gt)[:, [0, 2], 3]
+                xz_results[name] = pred[:, [0, 2], 3]
+
+        plot_job = None
+        if plot and len(method_errs) > 0:
+            xz_all = self.downsample_trajectories(xz_gt, *xz_results.values())
+            plot_job = (seq, xz_all[0], dict(zip(xz_results.keys(), xz_all[1:])),
+                            method_segment_errs)
+        return method_errs, plot_job
+
+    def plot_comparison(self, seq, xz_gt, xz_results, method_segment_errs):
+        """Plot trajectories and per-length errors of several methods
+        Args:
+            seq (int): sequence index
+            xz_gt (Nx2 array): ground truth x-z positions
+            xz_results (dict): {method name: Nx2 array}; predicted x-z positions
+            method_segment_errs (dict): {method name: avg_segment_errs}
+        """
+        self.plot_trajectories_xz(xz_gt, xz_results, seq)
+        self.plot_errors(method_segment_errs, seq)
+
+    def comparison_table(self, compare_results, names):
+        """Format compared metrics as text tables, in the units of result.txt.
+        The mean is taken over the sequences evaluated by all methods
+        Args:
+            compare_results (dict): {seq: {method name: errs}}, see compare
+            names (list): method names, in table order
+        Returns:
+            table (str): one table per sequence and one of the mean
+        """
+        header = ["Method", "Trans. err. (%)", "Rot. err. (deg/100m)",
+                    "ATE (m)", "RPE (m)", "RPE (deg)"]
+        name_width = max([len(header[0])] + [len(name) for name in names])
+
+        def format_rows(method_errs):
+            lines = ["  ".join([header[0].ljust(name_width)] + header[1:])]
+            for name in names:
+                if name not in method_errs:
+                    continue
+                errs = np.asarray(method_errs[name]) * METRIC_UNIT_SCALES
+                lines.append("  ".join(
+                    [name.ljust(name_width)] +
+                    ["{:.3f}".format(err).rjust(len(title)) for err, title in zip(errs, header[1:])]
+                    ))
+            return "\n".join(lines) + "\n\n"
+
+        table = ""
+        for seq, method_errs in compare_results.items():
+            table += "Sequence: \t {} \n".format(seq)
+            table += format_rows(method_errs)
+
+        common_seqs = [seq for seq, method_errs in compare_results.items()
+                        if all(name in method_errs for name in names)]
+        if len(common_seqs) > 0:
+            mean_errs = {
+                name: np.mean([compare_results[seq][name] for seq in common_seqs], axis=0)
+                for name in names
+                }
+            table += "Mean of sequences: \t {} \n".format(" ".join(str(i) for i in common_seqs))
+            table += format_rows(mean_errs)
+        return table
+
+    def write_comparison_csv(self, compare_results, file_name):
+        """Write compared metrics into a csv file, one row per sequence and
+        method, in the units of result.txt (see write_leaderboard)
+        Args:
+            compare_results (dict): {seq: {method name: errs}}, see compare
+            file_name (str): csv file path
+        """
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["seq", "method"] + METRIC_NAMES)
+            for seq, method_errs in compare_results.items():
+                for name, errs in method_errs.items():
+                    writer.writerow(["{:02}".format(seq), name] +
+                                        (np.asarray(errs) * METRIC_UNIT_SCALES).tolist())
+
+    def write_leaderboard(self, batch_results, file_name):
+        """Write results of many result directories into a csv file.
+        One row per result directory, ranked by the average translation error.
+        Errors use the units of result.txt: trans_err (%), rot_err (deg/100m),
+        ate (m), rpe_trans (m), rpe_rot (deg).
+        Args:
+            batch_results (dict): {result_dir: {seq: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}}
+            file_name (str): csv file path
+        """
+        all_seqs = sorted(set(seq for results in batch_results.values() for seq in results))
+        header = ["rank", "result_dir", "num_seqs"]
+        header += ["mean_" + name for name in METRIC_NAMES]
+        header += ["{:02}_{}".format(seq, name) for seq in all_seqs for name in METRIC_NAMES]
+
+        rows = []
+        for result_dir, results in batch_results.items():
+            errs = np.asarray([results[seq] for seq in sorted(results)], dtype=np.float64)
+            errs = errs.reshape(-1, len(METRIC_NAMES)) * METRIC_UNIT_SCALES
+            mean_errs = errs.mean(axis=0) if len(errs) > 0 else np.full(len(METRIC_NAMES), np.nan)
+            row = [result_dir, len(results)] + mean_errs.tolist()
+            for seq in all_seqs:
+                if seq in results:
+                    row += (np.asarray(results[seq]) * METRIC_UNIT_SCALES).tolist()
+                else:
+                    row += [""] * len(METRIC_NAMES)
+            rows.append(row)
+        rows.sort(key=lambda row: np.inf if np.isnan(row[2]) else row[2])
+
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for rank, row in enumerate(rows):
+                writer.writerow([rank + 1] + row)
+
+    def aggregate_results(self, seq_results, seq_reports):
+        """Reduce per-sequence metrics to overall metrics
+        Args:
+            seq_results (dict): {seq: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}
+            seq_reports (dict): {seq: report}, see profile_seq
+        Returns:
+            overall (dict):
+                - num_seqs (int): number of sequences
+                - mean (dict): unweighted mean of every metric over the sequences
+                - weighted (dict): segment-weighted errors, i.e. averages over
+                  the segments of all sequences like the KITTI devkit:
+                  num_segments, ave_t_err, ave_r_err and
+                  avg_segment_errs {100:[avg_t_err, avg_r_err],...}
+        """
+        metric_names = ["ave_t_err", "ave_r_err", "ate", "rpe_trans", "rpe_rot"]
+        seqs = list(seq_results.keys())
+        errs = np.asarray([seq_results[seq] for seq in seqs], dtype=np.float64).reshape(-1, 5)
+        mean_errs = errs.mean(axis=0) if len(seqs) > 0 else np.full(5, np.nan)
+
+        # seqs x lengths x [num_segments, t_err sum, r_err sum]
+        sums = np.asarray([seq_reports[seq]["segment_sums"] for seq in seqs], dtype=np.float64)
+        sums = sums.reshape(len(seqs), len(self.lengths), 3).sum(axis=0)
+        num_segments = sums[:, 0].sum()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            length_errs = sums[:, 1:] / sums[:, :1]
+            overall_errs = sums[:, 1:].sum(axis=0) / num_segments
+
+        weighted = {
+            "num_segments": int(num_segments),
+            "ave_t_err": float(overall_errs[0]) if num_segments > 0 else 0,
+            "ave_r_err": float(overall_errs[1]) if num_segments > 0 else 0,
+            "avg_segment_errs": {
+                len_: length_errs[cnt].tolist() if sums[cnt, 0] > 0 else []
+                for cnt, len_ in enumerate(self.lengths)
+                },
+            }
+        return {
+            "num_seqs": len(seqs),
+            "mean": dict(zip(metric_names, mean_errs.tolist())),
+            "weighted": weighted,
+            }
+
+    def export_results(self, file_base, seq_results, seq_reports, formats, alignment=None):
+        """Save all per-sequence and overall metrics in machine-readable files.
+        json keeps the units of SequenceMetrics.to_dict (ratio, rad/m, m, rad);
+        csv uses the units of result.txt, like write_leaderboard
+        Args:
+            file_base (str): file path without extension
+            seq_results (dict): {seq: [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]}
+            seq_reports (dict): {seq: report}, see profile_seq. num_frames
+                is added by eval
+            formats (list): json and/or csv
+            alignment (str): alignment type, see eval
+        """
+        overall = self.aggregate_results(seq_results, seq_reports)
+        if "json" in formats:
+            sequences = {}
+            for seq, errs in seq_results.items():
+                report = seq_reports[seq]
+                seq_summary = {
+                    "num_frames": report["num_frames"],
+                    "num_segments": int(report["segment_sums"][:, 0].sum()),
+                    }
+                seq_summary.update(zip(["ave_t_err", "ave_r_err", "ate", "rpe_trans", "rpe_rot"],
+                                        [float(i) for i in errs]))
+                for name in ["avg_segment_errs", "rpe_stats", "confidence_intervals", "local_ate"]:
+                    seq_summary[name] = report[name]
+                sequences["{:02}".format(seq)] = seq_summary
+            summary = {
+                "alignment": alignment,
+                "lengths": self.lengths,
+                "sequences": sequences,
+                "overall": overall,
+                }
+            with open(file_base + ".json", 'w') as f:
+                json.dump(summary, f, indent=2, default=float)
+
+        if "csv" in formats:
+            header = ["seq", "num_frames", "num_segments"] + METRIC_NAMES
+            header += ["{}_{}".format(name, len_) for len_ in self.lengths
+                        for name in ["trans_err", "rot_err"]]
+
+            def length_columns(avg_segment_errs):
+                row = []
+                for len_ in self.lengths:
+                    if len(avg_segment_errs[len_]) > 0:
+                        row += (np.asarray(avg_segment_errs[len_]) * METRIC_UNIT_SCALES[:2]).tolist()
+                    else:
+                        row += ["", ""]
+                return row
+
+            with open(file_base + ".csv", 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for seq, errs in seq_results.items():
+                    report = seq_reports[seq]
+                    writer.writerow(
+                        ["{:02}".format(seq), report["num_frames"],
+                            int(report["segment_sums"][:, 0].sum())] +
+                        (np.asarray(errs) * METRIC_UNIT_SCALES).tolist() +
+                        length_columns(report["avg_segment_errs"])
+                        )
+                # unweighted mean over the sequences
+                mean_errs = np.asarray([overall["mean"][name] for name in
+                                ["ave_t_err", "ave_r_err", "ate", "rpe_trans", "rpe_rot"]])
+                writer.writerow(
+                    ["mean", sum(report["num_frames"] for report in seq_reports.values()), ""] +
+                    (mean_errs * METRIC_UNIT_SCALES).tolist() + [""] * (2 * len(self.lengths))
+                    )
+                # segment-weighted errors
+                weighted = overall["weighted"]
+                writer.writerow(
+                    ["weighted", "", weighted["num_segments"],
+                        weighted["ave_t_err"] * METRIC_UNIT_SCALES[0],
+                        weighted["ave_r_err"] * METRIC_UNIT_SCALES[1], "", "", ""] +
+                    length_columns(weighted["avg_segment_errs"])
+                    )
+
+    def profile_seq(self, seq, result_dir, alignment=None, gt_state=None,
+                        plot=True, profile=None, cache_key=None):
+        """Evaluate a single sequence (see eval_seq) and time its stages
+        Args:
+            seq (int): sequence index
+            result_dir (str): pose predictions txt files directory
+            alignment (str): alignment type, see eval
+            gt_state (SequenceGT): precomputed ground truth. Loaded if None
+            plot (bool): plot trajectories and per-length errors
+            profile (str/None): extra profiling, see eval
+            cache_key (str/None): key of the sequence in self.result_cache
+        Returns:
+            errs (list): [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]
+            seq_timing (dict): stage timings and frame counts of the sequence
+            report (dict): optional results for write_result
+                - rpe_stats (dict/None): RPE statistics of self.rpe_deltas,
+                  see compute_RPE_deltas
+                - confidence_intervals (dict/None): bootstrap confidence
+                  intervals, see compute_confidence_intervals
+                - local_ate (dict/None): windowed ATE, see compute_local_ATE
+                - avg_segment_errs (dict): see compute_segment_error
+                - segment_sums (Lx3 array): see segment_error_sums
+            plot_job (tuple/None): arguments of plot_sequence if the plots
+                are left to the plotting process
+        """
+        self.timer = StageTimer(memory=profile == "tracemalloc")
+        profiler = cProfile.Profile() if profile == "cprofile" else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            metrics, plot_job = self.eval_seq(seq, result_dir, alignment, gt_state,
+                                              plot, cache_key)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.timer.close()
+
+        seq_timing = dict(self.timer.counts)
+        seq_timing["time"] = time.perf_counter() - start
+        seq_timing["stages"] = self.timer.stages
+        if profiler is not None:
+            prof_file = os.path.join(result_dir, "profile_{:02}.prof".format(seq))
+            profiler.dump_stats(prof_file)
+            seq_timing["profile"] = prof_file
+            seq_timing["top_functions"] = profile_summary(profiler)
+        self.timer = StageTimer()
+        report = {
+            "rpe_stats": metrics.rpe_stats,
+            "confidence_intervals": metrics.confidence_intervals,
+            "local_ate": metrics.local_ate,
+            "avg_segment_errs": metrics.avg_segment_errs,
+            "segment_sums": self.segment_error_sums(metrics.seq_err),
+        }
+        return metrics.errs(), seq_timing, report, plot_job
+
+    def save_timing(self, file_name, main_timer, seq_timings, total_time,
+                        workers=1, profile=None):
+        """Save stage timings of an evaluation as json
+        Args:
+            file_name (str): json file path
+            main_timer (StageTimer): stages run in the main process
+            seq_timings (dict): {"XX": seq_timing}, see profile_seq
+            total_time (float): wall time of the evaluation
+            workers (int): number of processes
+            profile (str/None): extra profiling, see eval
+        """
+        # stage times summed over sequences
+        stage_totals = {}
+        for seq_timing in seq_timings.values():
+            for name, record in seq_timing["stages"].items():
+                stage_totals[name] = stage_totals.get(name, 0.) + record["time"]
+        for name, record in main_timer.stages.items():
+            stage_totals[name] = stage_totals.get(name, 0.) + record["time"]
+
+        timing = {
+            "total_time": total_time,
+            "num_frames": sum(t.get("num_frames", 0) for t in seq_timings.values()),
+            "workers": workers,
+            "profile": profile,
+            "stage_totals": stage_totals,
+            "main_stages": main_timer.stages,
+            "sequences": seq_timings,
+        }
+        with open(file_name, 'w') as f:
+            json.dump(timing, f, indent=2)
+
+    def index_frames(self, frame_ids, gt_state):
+        """Locate predicted frames on the ground-truth timeline
+        Args:
+            frame_ids (N int array): sorted predicted frame indexs
+            gt_state (SequenceGT): ground truth
+        Returns:
+            frames (FrameIndex): predicted frames
+        """
+        if np.any(frame_ids[1:] == frame_ids[:-1]):
+            raise ValueError("Predicted frames of sequence {} are duplicated".format(self.cur_seq))
+        gt_index = np.searchsorted(gt_state.frame_ids, frame_ids)
+        if np.any(gt_index >= len(gt_state.frame_ids)) or \
+                np.any(gt_state.frame_ids[np.minimum(gt_index, len(gt_state.frame_ids)-1)] != frame_ids):
+            raise ValueError("Predicted frames of sequence {} are not in the ground truth".format(self.cur_seq))
+        return FrameIndex(frame_ids, gt_index, len(gt_state.frame_ids))
+
+    def sort_frames(self, frame_ids, pose_array):
+        """Sort predictions by frame index; result files may list frames in any order
+        Args:
+            frame_ids (N int array): predicted frame indexs
+            pose_array (Nx3x4 array): predicted poses
+        Returns:
+            frame_ids (N int array): sorted frame indexs
+            pose_array (Nx3x4 array): poses in the order of frame_ids
+        """
+        if np.all(frame_ids[1:] > frame_ids[:-1]):
+            return frame_ids, pose_array
+        order = np.argsort(frame_ids, kind="stable")
+        return frame_ids[order], pose_array[order]
+
+    def gather_poses(self, frames, pose_array, gt_state):
+        """Stack predictions and the ground truth of the predicted frames
+        Args:
+            frames (FrameIndex): predicted frames
+            pose_array (Nx3x4 array): predicted poses, in the order of frames.frame_ids
+            gt_state (SequenceGT): ground truth
+        Returns:
+            pred (Nx4x4 array): predicted poses
+            gt (Nx4x4 array): ground truth poses of the predicted frames
+        """
+        pred = to_homogeneous(pose_array)
+        gt = to_homogeneous(gt_state.poses, frames.gt_index)
+        self.orthonormalize(pred, pose_array.dtype)
+        self.orthonormalize(gt, gt_state.poses.dtype)
+        return pred, gt
+
+    def normalize_poses(self, frame_ids, pred, gt):
+        """Express poses w.r.t the first predicted frame, in place
+        Args:
+            frame_ids (N int array): predicted frame indexs
+            pred (Nx4x4 array): predicted poses
+            gt (Nx4x4 array): ground truth poses of the predicted frames
+        """
+        idx_0 = np.argmin(frame_ids)
+        np.matmul(np.linalg.inv(pred[idx_0]), pred, out=pred)
+        np.matmul(np.linalg.inv(gt[idx_0]), gt, out=gt)
+
+    def normalize_gt(self, gt_state, idx_0):
+        """Express the whole ground truth w.r.t one of its frames and segment
+        it again, so that distances and segment relative poses are computed
+        from the normalized poses bit-for-bit as in the per-pair loop of
+        calc_sequence_errors. The result is kept in gt_state.normalized for
+        later evaluations starting at the same frame
+        Args:
+            gt_state (SequenceGT): ground truth
+            idx_0 (int): position of the first predicted frame in the ground truth
+        Returns:
+            gt_state (SequenceGT): normalized ground truth
+        """
+        if idx_0 not in gt_state.normalized:
+            poses = to_homogeneous(gt_state.poses)
+            self.orthonormalize(poses, gt_state.poses.dtype)
+            np.matmul(np.linalg.inv(poses[idx_0]), poses, out=poses)
+            gt_state.normalized[idx_0] = self.segment_gt_arrays(gt_state.frame_ids, poses)
+        return gt_state.normalized[idx_0]
+
+    def align_poses(self, pred, gt, alignment):
+        """Align predictions to the ground truth, in place
+        Args:
+            pred (Nx4x4 array): predicted poses
+            gt (Nx4x4 array): ground truth poses of the predicted frames
+            alignment (str): alignment type, see eval
+        """
+        if alignment == "scale":
+            scale = scale_lse_solver(pred[:, :3, 3], gt[:, :3, 3])
+            pred[:, :3, 3] *= scale
+        elif alignment == "scale_7dof" or alignment == "7dof" or alignment == "6dof":
+            r, t, scale = umeyama_alignment(pred[:, :3, 3].T, gt[:, :3, 3].T, alignment!="6dof",
+                                            exact=not self.fast)
+
+            align_transformation = np.eye(4)
+            align_transformation[:3:, :3] = r
+            align_transformation[:3, 3] = t
+
+            pred[:, :3, 3] *= scale
+            if alignment=="7dof" or alignment=="6dof":
+                np.matmul(align_transformation, pred, out=pred)
+
+    def eval_seq(self, seq, result_dir, alignment=None, gt_state=None, plot=True,
+                    cache_key=None):
+        """Evaluate a single sequence; writes its errors and plots
+        Args:
+            seq (int): sequence index
+            result_dir (str): pose predictions txt files directory
+            alignment (str): alignment type, see eval
+            gt_state (SequenceGT): precomputed ground truth. Loaded if None
+            plot (bool): plot trajectories and per-length errors
+            cache_key (str/None): key of the sequence in self.result_cache.
+                The cached result is restored if available, otherwise the
+                result is added to the cache
+        Returns:
+            metrics (SequenceMetrics): metrics of the sequence
+            plot_job (tuple/None): arguments of plot_sequence if plotting is
+                left to the caller (self.plot_async)
+        """
+        i = seq
+        # Read pose txt
+        self.cur_seq = '{:02}'.format(i)
+        file_name = '{:02}.txt'.format(i)
+
+        timer = self.timer
+        if cache_key is not None:
+            with timer.stage("cache"):
+                entry = self.result_cache.load(cache_key)
+            if entry is not None:
+                return self.restore_cached_seq(seq, entry, plot)
+
+        if gt_state is None:
+            with timer.stage("prepare_gt"):
+                gt_state = self.prepare_gt(seq)
+        with timer.stage("load"):
+            frame_ids, pose_array = self.load_pose_array(result_dir+"/"+file_name)
+            pose_array = pose_array.astype(self.pose_dtype, copy=False)
+            self.result_file_name = result_dir+file_name
+            frame_ids, pose_array = self.sort_frames(frame_ids, pose_array)
+            frames = self.index_frames(frame_ids, gt_state)
+
+            # Predictions and the GT of the predicted frames as Nx4x4 arrays
+            # in frame order; every step below updates them in place
+            pred, gt = self.gather_poses(frames, pose_array, gt_state)
+            del pose_array
+        timer.count("num_frames", len(frame_ids))
+        timer.count("num_gt_frames", len(gt_state.frame_ids))
+
+        metrics = self.compute_metrics(frames, pred, gt, gt_state, alignment)
+        seq_err = metrics.seq_err
+        avg_segment_errs = metrics.avg_segment_errs
+        with timer.stage("write"):
+            self.save_sequence_errors(
+                seq_err,
+                self.error_dir + "/{:02}.{}".format(i, self.error_format)
+                )
+
+        # Plotting
+        plot_job = None
+        xz_gt, xz_result = None, None
+        if plot or cache_key is not None:
+            with timer.stage("plot"):
+                xz_gt, xz_result = self.downsample_trajectories(
+                                        gt[:, [0, 2], 3],
+                                        pred[:, [0, 2], 3]
+                                        )
+                if plot and self.plot_async:
+                    plot_job = (i, xz_gt, xz_result, avg_segment_errs)
+                elif plot:
+                    self.plot_sequence(i, xz_gt, xz_result, avg_segment_errs)
+
+        if cache_key is not None:
+            with timer.stage("cache"):
+                self.result_cache.save(cache_key, {
+                    "errs": metrics.errs(),
+                    "rpe_stats": metrics.rpe_stats,
+                    "confidence_intervals": metrics.confidence_intervals,
+                    "local_ate": metrics.local_ate,
+                    "counts": dict(timer.counts),
+                    "seq_err": seq_err,
+                    "xz_gt": xz_gt,
+                    "xz_result": xz_result,
+                    })
+        return metrics, plot_job
+
+    def compute_metrics(self, frames, pred, gt, gt_state, alignment=None):
+        """Compute all metrics of a sequence from stacked poses, without any
+        file access. pred and gt are normalized and aligned in place
+        Args:
+            frames (FrameIndex): predicted frames
+            pred (Nx4x4 array): predicted poses, in the order of frames.frame_ids
+            gt (Nx4x4 array): ground truth poses of the predicted frames
+            gt_state (SequenceGT): ground truth
+            alignment (str): alignment type, see eval
+        Returns:
+            metrics (SequenceMetrics): metrics of the sequence
+        """
+        timer = self.timer
+        frame_ids = frames.frame_ids
+
+        # Pose alignment to first frame
+        with timer.stage("normalize"):
+            if not self.fast:
+                gt_state = self.normalize_gt(gt_state, frames.gt_index[np.argmin(frame_ids)])
+            self.normalize_poses(frame_ids, pred, gt)
+        with timer.stage("align"):
+            self.align_poses(pred, gt, alignment)
+
+        # compute sequence errors
+        with timer.stage("calc_sequence_errors"):
+            seq_err = self.calc_sequence_errors_arrays(frames, pred, gt_state)
+        timer.count("num_segments", len(seq_err))
+
+        # Compute segment errors
+        with timer.stage("compute_segment_error"):
+            avg_segment_errs = self.compute_segment_error(seq_err)
+
+            # compute overall error
+            ave_t_err, ave_r_err = self.compute_overall_err(seq_err)
+
+        # Compute ATE
+        with timer.stage("compute_ATE"):
+            ate_errs = self.ate_errors(gt, pred)
+            ate = np.sqrt(np.mean(ate_errs ** 2))
+
+        # Compute RPE
+        with timer.stage("compute_RPE"):
+            # poses are inverted once for the 1-frame RPE and all extra deltas
+            inverses = self.rpe_inverses(gt, pred)
+            rpe_trans_errs, rpe_rot_errs = self.rpe_errors(gt, pred, inverses)
+            rpe_trans = error_statistics(rpe_trans_errs)["mean"]
+            rpe_rot = error_statistics(rpe_rot_errs)["mean"]
+            rpe_stats = None
+            if self.rpe_deltas is not None:
+                rpe_stats = self.compute_RPE_deltas_arrays(
+                                    frame_ids, gt, pred,
+                                    self.rpe_deltas, self.rpe_delta_unit,
+                                    inverses
+                                    )
+            del inverses
+
+        local_ate = None
+        if self.local_window is not None:
+            with timer.stage("compute_local_ATE"):
+                local_ate = self.compute_local_ATE(frame_ids, gt, pred)
+
+        confidence_intervals = None
+        if self.bootstrap_resamples > 0:
+            with timer.stage("bootstrap"):
+                confidence_intervals = self.compute_confidence_intervals(
+                                            gt_state, frame_ids, seq_err, ate_errs,
+                                            rpe_trans_errs, rpe_rot_errs
+                                            )
+
+        return SequenceMetrics(
+                    ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot,
+                    avg_segment_errs, seq_err, rpe_stats, len(frame_ids),
+                    confidence_intervals, local_ate
+                    )
+
+    def local_ate_errors(self, frame_ids, gt, pred, window, step=None,
+                            unit="frame", alignment="7dof"):
+        """ATE of windows of a trajectory, each aligned separately.
+        Windows start every step frames (or meters of the ground truth
+        trajectory) and span window frames (or meters); incomplete windows
+        at the end are skipped.
+        Args:
+            frame_ids (N int array): sorted frame indexs
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses
+            window (float): window size
+            step (float): distance between window starts. window if None
+            unit (str): unit of window and step, frame or m
+            alignment (str): alignment of each window, 7dof or 6dof
+        Returns:
+            first_frames (W int array): first frame index of each window
+            errors (W array): RMSE of ATE of each window
+        """
+        if alignment not in ["7dof", "6dof"]:
+            raise ValueError("Unknown local alignment: {}".format(alignment))
+        step = window if step is None else step
+        frame_ids = np.asarray(frame_ids)
+        if unit == "frame":
+            timeline = frame_ids
+            starts = np.arange(frame_ids[0], frame_ids[-1] - window + 2, step)
+            start_idx = np.searchsorted(timeline, starts, side='left')
+            stop_idx = np.searchsorted(timeline, starts + window, side='left')
+        elif unit == "m":
+            timeline = self.trajectory_distances(gt)
+            starts = np.arange(0, timeline[-1] - window, step)
+            start_idx = np.searchsorted(timeline, starts, side='left')
+            stop_idx = np.searchsorted(timeline, starts + window, side='right')
+        else:
+            raise ValueError("Unknown window unit: {}".format(unit))
+        # at least 3 poses are needed for a rotation
+        valid = stop_idx - start_idx >= 3
+        start_idx = start_idx[valid]
+        stop_idx = stop_idx[valid]
+        if len(start_idx) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        errors = windowed_alignment_errors(
+                    pred[:, :3, 3], gt[:, :3, 3],
+                    start_idx, stop_idx, alignment == "7dof"
+                    )
+        return frame_ids[start_idx], errors
+
+    def compute_local_ATE(self, frame_ids, gt, pred):
+        """Compute ATE statistics of separately aligned windows, with the
+        window settings self.local_window, self.local_window_step,
+        self.local_window_unit and self.local_alignment
+        Args:
+            frame_ids (N int array): sorted frame indexs
+            gt (Nx4x4 array): ground-truth poses
+            pred (Nx4x4 array): predicted poses
+        Returns:
+            local_ate (dict): {"num_windows": int,
+                               "stats": {mean, rmse, median, max} of window ATE (m)}
+        """
+        _, errors = self.local_ate_errors(
+                        frame_ids, gt, pred,
+                        self.local_window, self.local_window_step,
+                        self.local_window_unit, self.local_alignment
+                        )
+        return {"num_windows": len(errors), "stats": error_statistics(errors)}
+
+    def bootstrap_block_size(self, gt_state):
+        """Number of frames of a bootstrap block: self.bootstrap_block, or
+        if None the longest ground-truth segment span, since a segment is
+        correlated with every segment overlapping it
+        Args:
+            gt_state (SequenceGT): ground truth segments
+        Returns:
+            block (int): number of frames of a bootstrap block
+        """
+        if self.bootstrap_block is not None:
+            return self.bootstrap_block
+        if len(gt_state.first_frames) == 0:
+            return 1
+        spans = gt_state.frame_ids[gt_state.last_frames] - gt_state.frame_ids[gt_state.first_frames]
+        return max(int(np.max(spans)), 1)
+
+    def compute_confidence_intervals(self, gt_state, frame_ids, seq_err, ate_errs,
+                                        rpe_trans_errs, rpe_rot_errs):
+        """Bootstrap confidence intervals of the sequence metrics.
+        Errors are resampled in blocks of frames (by segment start frame for
+        the segment errors), which keeps the correlation of overlapping
+        segments and neighbouring frames, see bootstrap_block_size
+        Args:
+            gt_state (SequenceGT): ground truth segments
+            frame_ids (N int array): sorted predicted frame indexs
+            seq_err (list list): segment errors, see calc_sequence_errors
+            ate_errs (N array): ATE of each frame, see ate_errors
+            rpe_trans_errs (N-1 array): RPE translation errors, see rpe_errors
+            rpe_rot_errs (N-1 array): RPE rotation errors, see rpe_errors
+        Returns:
+            confidence_intervals (dict): {t_err, r_err, ate, rpe_trans, rpe_rot}
+                [lower, upper] intervals at self.confidence, in the units of
+                [ave_t_err, ave_r_err, ate, rpe_trans, rpe_rot]
+        """
+        block = self.bootstrap_block_size(gt_state)
+        err_array = errors_to_array(seq_err)
+        seg_blocks = err_array["first_frame"] // block
+        frame_blocks = np.asarray(frame_ids) // block
+        samples = {
+            "t_err": (err_array["t_err"], seg_blocks, False),
+            "r_err": (err_array["r_err"], seg_blocks, False),
+            "ate": (ate_errs ** 2, frame_blocks, True),
+            "rpe_trans": (rpe_trans_errs, frame_blocks[:-1], False),
+            "rpe_rot": (rpe_rot_errs, frame_blocks[:-1], False),
+        }
+        confidence_intervals = {}
+        for cnt, (name, (values, block_ids, root)) in enumerate(samples.items()):
+            confidence_intervals[name] = block_bootstrap_ci(
+                                            values, block_ids,
+                                            self.bootstrap_resamples, self.confidence,
+                                            seed=cnt, root=root
+                                            )
+        return confidence_intervals
+
+    def gt_state_from_poses(self, gt):
+        """Prepare in-memory ground truth for eval_poses
+        Args:
+            gt (Nx3x4 array / Nx4x4 array / dict): ground truth poses of
+                frames 0, 1, ..., or {idx: 3x4/4x4 array}
+        Returns:
+            gt_state (SequenceGT): ground truth quantities
+        """
+        if isinstance(gt, dict):
+            gt_ids = np.asarray(sorted(gt.keys()), dtype=np.int64)
+            pose_array = np.asarray([np.asarray(gt[i])[:3] for i in gt_ids.tolist()], dtype=np.float64)
+            return self.segment_gt_arrays(gt_ids, pose_array)
+        gt = np.asarray(gt, dtype=np.float64)
+        return self.segment_gt_arrays(np.arange(len(gt), dtype=np.int64), gt)
+
+    def eval_poses(self, gt, pred, frame_ids=None, alignment=None,
+                    rpe_deltas=None, rpe_delta_unit="frame",
+                    bootstrap=0, bootstrap_block=None, confidence=0.95,
+                    local_window=None, local_window_step=None,
+                    local_window_unit="frame", local_alignment="7dof"):
+        """Evaluate poses held in memory, e.g. during training.
+        Nothing is read from or written to disk.
+        Args:
+            gt (Nx3x4 array / Nx4x4 array / dict / SequenceGT): ground truth
+                poses of frames 0, 1, ..., {idx: 3x4/4x4 array}, or ground truth
+                prepared by gt_state_from_poses / prepare_gt to reuse it across calls
+            pred (Mx3x4 array / Mx4x4 array / dict): predicted poses,
+                or {idx: 3x4/4x4 array}
+            frame_ids (M int array): frame indexs of the pred array.
+                0, 1, ..., M-1 if None
+            alignment (str): alignment type, see eval
+            rpe_deltas (list/None): extra RPE deltas, see eval
+            rpe_delta_unit (str): unit of rpe_deltas, frame or m
+            bootstrap (int): number of bootstrap resamples, see eval
+            bootstrap_block (int/None): number of frames of a bootstrap
+                block, see eval
+            confidence (float): confidence level of the intervals
+            local_window (float/None): windowed alignment ATE, see eval
+            local_window_step (float/None): distance between window starts
+            local_window_unit (str): unit of the window, frame or m
+            local_alignment (str): alignment of each window, 7dof or 6dof
+        Returns:
+            metrics (SequenceMetrics): metrics of the sequence
+        """
+        self.cur_seq = "in-memory"
+        self.rpe_deltas = rpe_deltas
+        self.rpe_delta_unit = rpe_delta_unit
+        self.bootstrap_resamples = bootstrap
+        self.bootstrap_block = bootstrap_block
+        self.confidence = confidence
+        self.local_window = local_window
+        self.local_window_step = local_window_step
+        self.local_window_unit = local_window_unit
+        self.local_alignment = local_alignment
+        gt_state = gt if isinstance(gt, SequenceGT) else self.gt_state_from_poses(gt)
+
+        if isinstance(pred, dict):
+            frame_ids = np.asarray(sorted(pred.keys()), dtype=np.int64)
+            pose_array = np.asarray([pred[i] for i in frame_ids.tolist()], dtype=self.pose_dtype)
+        else:
+            pose_array = np.asarray(pred, dtype=self.pose_dtype)
+            if frame_ids is None:
+                frame_ids = np.arange(len(pose_array), dtype=np.int64)
+            frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        frame_ids, pose_array = self.sort_frames(frame_ids, pose_array)
+        frames = self.index_frames(frame_ids, gt_state)
+        pred, gt = self.gather_poses(frames, pose_array, gt_state)
+        return self.compute_metrics(frames, pred, gt, gt_state, alignment)
+
+    def cache_key(self, seq, result_dir, alignment=None):
+        """Key of a sequence evaluation in self.result_cache, from the content
+        of the prediction and ground truth files and the evaluation parameters
+        Args:
+            seq (int): sequence index
+            result_dir (str): pose predictions txt files directory
+            alignment (str): alignment type, see eval
+        Returns:
+            key (str): cache key
+        """
+        file_name = '{:02}.txt'.format(seq)
+        if self.gt_store is not None:
+            gt_digest = self.gt_store.digest('{:02}'.format(seq))
+        else:
+            gt_digest = file_digest(os.path.join(self.gt_dir, file_name))
+        return self.result_cache.key(
+                    file_digest(os.path.join(result_dir, file_name)),
+                    gt_digest,
+                    alignment, self.lengths, self.step_size, self.fps,
+                    self.rpe_deltas, self.rpe_delta_unit,
+                    self.bootstrap_resamples, self.bootstrap_block, self.confidence,
+                    self.local_window, self.local_window_step,
+                    self.local_window_unit, self.local_alignment, self.pose_dtype.str,
+                    self.fast, self.robust_rotation, self.plot_tolerance, self.plot_max_points, self.plot_dpi
+                    )
+
+    def restore_cached_seq(self, seq, entry, plot=True):
+        """Restore the outputs of a sequence from a result cache entry.
+        Plots are only rendered if they do not exist yet
+        Args:
+            seq (int): sequence index
+            entry (dict): cache entry, see ResultCache.save
+            plot (bool): plot trajectories and per-length errors
+        Returns:
+            metrics (SequenceMetrics): cached metrics of the sequence
+            plot_job (tuple/None): see eval_seq
+        """
+        timer = self.timer
+        for name, value in entry["counts"].items():
+            timer.count(name, value)
+        timer.count("cache_hit", 1)
+        with timer.stage("write"):
+            self.save_sequence_errors(
+                entry["seq_err"],
+                self.error_dir + "/{:02}.{}".format(seq, self.error_format)
+                )
+        avg_segment_errs = self.compute_segment_error(entry["seq_err"])
+        metrics = SequenceMetrics(
+            *entry["errs"], avg_segment_errs, entry["seq_err"],
+            rpe_stats=entry["rpe_stats"],
+            num_frames=entry["counts"].get("num_frames", 0),
+            confidence_intervals=entry["confidence_intervals"],
+            local_ate=entry["local_ate"]
+            )
+
+        plot_job = None
+        plot_files = [
+            self.plot_path_dir + "/sequence_{:02}.{}".format(seq, self.plot_format),
+            self.plot_error_dir + "/trans_err_{:02}.{}".format(seq, self.plot_format),
+            self.plot_error_dir + "/rot_err_{:02}.{}".format(seq, self.plot_format),
+            ]
+        if plot and not all(os.path.exists(plot_file) for plot_file in plot_files):
+            with timer.stage("plot"):
+                plot_job = (seq, entry["xz_gt"], entry["xz_result"], avg_segment_errs)
+                if not self.plot_async:
+                    self.plot_sequence(*plot_job)
+                    plot_job = None
+        return metrics, plot_job
@@ -0,0 +1,246 @@
+# Copyright (C) Huangying Zhan 2019. All rights reserved.
+
+from collections import deque
+import time
+
+import numpy as np
+
+from kitti_odometry import KittiEvalOdom
+
+
+def follow_poses(file_name, poll_interval=0.5, timeout=None):
+    """Read poses from a txt file (KITTI format) which may still be growing.
+    Lines are yielded as soon as they are complete; the file is polled for
+    new lines until no data arrives for timeout seconds.
+    Args:
+        file_name (str): txt file path
+        poll_interval (float): seconds between polls at the end of the file
+        timeout (float): stop after this many idle seconds. Never stop if None
+    Yields:
+        frame_idx (int): frame index
+        pose (3x4 array): pose
+    """
+    cnt = 0
+    pending = ""
+    last_data = time.time()
+    with open(file_name, 'r') as f:
+        while True:
+            line = f.readline()
+            if line == "":
+                if timeout is not None and time.time() - last_data > timeout:
+                    return
+                time.sleep(poll_interval)
+                continue
+            last_data = time.time()
+            pending += line
+            if not pending.endswith("\n"):
+                # wait for the writer to finish the line
+                continue
+            line_split = pending.split()
+            pending = ""
+            if len(line_split) == 0:
+                continue
+            line_split = np.asarray(line_split, dtype=np.float64)
+            withIdx = len(line_split) == 13
+            frame_idx = int(line_split[0]) if withIdx else cnt
+            cnt += 1
+            yield frame_idx, line_split[withIdx:].reshape(3, 4)
+
+
+class KittiStreamEvalOdom(KittiEvalOdom):
+    """Evaluate odometry result incrementally while the poses arrive.
+    Segment errors, ATE and RPE are kept as running sums, and only the
+    segments which are not yet long enough are kept in memory, so memory
+    is bounded by the largest segment length instead of the trajectory.
+    Alignment is not supported since it needs the whole trajectory.
+    Usage example:
+        stream_eval = KittiStreamEvalOdom(gt_pose_txt)
+        for frame_idx, pose in follow_poses(result_pose_txt):
+            stream_eval.update(frame_idx, pose)
+        print(stream_eval.result())
+    """
+    def __init__(self, gt_file, lengths=None, step_size=10, fps=10):
+        """
+        Args:
+            gt_file (str): ground truth poses txt file
+            lengths (list): segment lengths (m), see KittiEvalOdom
+            step_size (int): number of frames between segment start frames
+            fps (float): frame rate
+        """
+        super().__init__(lengths, step_size, fps)
+        gt_ids, self.gt_poses = self.load_pose_array(gt_file, cache=True)
+        if not np.array_equal(gt_ids, np.arange(len(gt_ids))):
+            raise ValueError("Ground truth frames have to be 0, 1, 2, ...")
+        self.reset()
+
+    def reset(self):
+        """Clear all running statistics"""
+        self.num_frames = 0
+        self.last_frame = -1
+
+        # frame-0 normalization
+        self.pred_0_inv = None
+        self.gt_0_inv = None
+
+        # GT cumulative distance; GT frames are consumed in order
+        self.gt_frame = 0
+        self.dist = 0.
+
+        # open segments: [first_frame, dist, pred_inv, gt_inv, next length index]
+        self.open_segments = deque()
+        # {length: [number of segments, sum of t_err, sum of r_err]}
+        self.segment_sums = {len_: [0, 0., 0.] for len_ in self.lengths}
+
+        self.ate_sq_sum = 0.
+        self.rpe_count = 0
+        self.rpe_trans_sum = 0.
+        self.rpe_rot_sum = 0.
+        self.prev_pose = None
+
+    def update(self, frame_idx, pose):
+        """Add the prediction of a new frame
+        Args:
+            frame_idx (int): frame index. Frames have to arrive in increasing order
+            pose (3x4 array / 4x4 array): predicted pose
+        """
+        frame_idx = int(frame_idx)
+        if frame_idx <= self.last_frame:
+            raise ValueError("Frame {} arrived after frame {}".format(frame_idx, self.last_frame))
+        if frame_idx >= len(self.gt_poses):
+            raise ValueError("Frame {} is not in the ground truth".format(frame_idx))
+        pred = np.eye(4)
+        pred[:3] = pose[:3]
+        gt = np.eye(4)
+        gt[:3] = self.gt_poses[frame_idx]
+
+        # Pose alignment to first frame
+        if self.pred_0_inv is None:
+            self.pred_0_inv = np.linalg.inv(pred)
+            self.gt_0_inv = np.linalg.inv(gt)
+        pred = self.pred_0_inv @ pred
+        gt = self.gt_0_inv @ gt
+
+        self.update_segments(frame_idx, pred, gt)
+
+        # ATE
+        align_err = gt[:3, 3] - pred[:3, 3]
+        self.ate_sq_sum += np.sum(align_err ** 2)
+
+        # RPE to the previous received frame, as rpe_errors in batch eval
+        if self.prev_pose is not None:
+            prev_pred, prev_gt = self.prev_pose
+            gt_rel = np.linalg.inv(prev_gt) @ gt
+            pred_rel = np.linalg.inv(prev_pred) @ pred
+            rel_err = np.linalg.inv(gt_rel) @ pred_rel
+            self.rpe_count += 1
+            self.rpe_trans_sum += self.translation_error(rel_err)
+            self.rpe_rot_sum += self.rotation_error(rel_err)
+        self.prev_pose = (pred, gt)
+
+        self.last_frame = frame_idx
+        self.num_frames += 1
+
+    def update_segments(self, frame_idx, pred, gt):
+        """Advance the GT distance up to frame_idx and close the segments
+        ending there. Segments ending at frames without prediction are dropped.
+        Args:
+            frame_idx (int): frame index of the new prediction
+            pred (4x4 array): normalized predicted pose
+            gt (4x4 array): normalized ground truth pose
+        """
+        while self.gt_frame <= frame_idx:
+            j = self.gt_frame
+            if j > 0:
+                delta = self.gt_poses[j - 1, :, 3] - self.gt_poses[j, :, 3]
+                self.dist = self.dist + np.sqrt(delta[0]**2+delta[1]**2+delta[2]**2)
+
+            # close segments whose length is reached at frame j
+            for segment in list(self.open_segments):
+                first_frame, first_dist, pred_inv, gt_inv, len_idx = segment
+                while len_idx < self.num_lengths and \
+                        self.dist > first_dist + self.lengths[len_idx]:
+                    if j == frame_idx:
+                        self.add_segment_error(pred_inv @ pred, gt_inv @ gt, self.lengths[len_idx])
+                    len_idx += 1
+                segment[4] = len_idx
+            while len(self.open_segments) > 0 and self.open_segments[0][4] == self.num_lengths:
+                self.open_segments.popleft()
+
+            # open a new segment
+            if j == frame_idx and j % self.step_size == 0:
+                self.open_segments.append([j, self.dist, np.linalg.inv(pred), np.linalg.inv(gt), 0])
+            self.gt_frame += 1
+
+    def add_segment_error(self, pose_delta_result, pose_delta_gt, len_):
+        """Accumulate the error of a finished segment
+        Args:
+            pose_delta_result (4x4 array): predicted relative pose
+            pose_delta_gt (4x4 array): ground truth relative pose
+            len_ (int): segment length
+        """
+        pose_error = np.linalg.inv(pose_delta_result) @ pose_delta_gt
+        sums = self.segment_sums[len_]
+        sums[0] += 1
+        sums[1] += self.translation_error(pose_error) / len_
+        sums[2] += self.rotation_error(pose_error) / len_
+
+    def result(self):
+        """Current metrics of the frames received so far
+        Returns:
+            metrics (dict):
+                - num_frames: number of received frames
+                - ave_t_err, ave_r_err: average translation / rotation error
+                - avg_segment_errs: {100:[avg_t_err, avg_r_err],...}
+                - ate: RMSE of ATE
+                - rpe_trans, rpe_rot: RPE
+        """
+        num_segments = sum(sums[0] for sums in self.segment_sums.values())
+        if num_segments > 0:
+            ave_t_err = sum(sums[1] for sums in self.segment_sums.values()) / num_segments
+            ave_r_err = sum(sums[2] for sums in self.segment_sums.values()) / num_segments
+        else:
+            ave_t_err, ave_r_err = 0, 0
+        avg_segment_errs = {}
+        for len_, sums in self.segment_sums.items():
+            avg_segment_errs[len_] = [sums[1] / sums[0], sums[2] / sums[0]] if sums[0] > 0 else []
+
+        metrics = {}
+        metrics["num_frames"] = self.num_frames
+        metrics["ave_t_err"] = ave_t_err
+        metrics["ave_r_err"] = ave_r_err
+        metrics["avg_segment_errs"] = avg_segment_errs
+        metrics["ate"] = np.sqrt(self.ate_sq_sum / max(self.num_frames, 1))
+        metrics["rpe_trans"] = self.rpe_trans_sum / max(self.rpe_count, 1)
+        metrics["rpe_rot"] = self.rpe_rot_sum / max(self.rpe_count, 1)
+        return metrics
+
+    def eval_stream(self, result_file, poll_interval=0.5, timeout=None,
+                        report_every=None):
+        """Evaluate a pose txt file while it is being written
+        Args:
+            result_file (str): pose predictions txt file
+            poll_interval (float): seconds between polls at the end of the file
+            timeout (float): stop after this many idle seconds. Never stop if None
+            report_every (int): print the metrics every report_every frames
+        Returns:
+            metrics (dict): final metrics, see result
+        """
+        for frame_idx, pose in follow_poses(result_file, poll_interval, timeout):
+            self.update(frame_idx, pose)
+            if report_every and self.num_frames % report_every == 0:
+                self.print_result()
+        self.print_result()
+        return self.result()
+
+    def print_result(self):
+        """Print the current metrics"""
+        metrics = self.result()
+        print("Frames: {} \t Trans. err. (%): {:.3f} \t Rot. err. (deg/100m): {:.3f} \t "
+                "ATE (m): {:.3f} \t RPE (m): {:.3f} \t RPE (deg): {:.3f}".format(
+                    metrics["num_frames"],
+                    metrics["ave_t_err"] * 100,
+                    metrics["ave_r_err"] / np.pi * 180 * 100,
+                    metrics["ate"],
+                    metrics["rpe_trans"],
+                    metrics["rpe_rot"] * 180 / np.pi,
+                    ))